@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import os.path
+import argparse
+import subprocess
+from time import strftime, localtime
+from tempfile import TemporaryDirectory
+from collections import OrderedDict
+from colorama import init as colorama_init
+from colorama import Fore, Style
+
+project_name = 'Xiaomi Mi Flora Plant Sensor MQTT Client/Daemon - Benchmark'
+project_url = 'https://github.com/ThomDietrich/miflora-mqtt-daemon'
+
+reporting_modes = ['mqtt-json', 'mqtt-homie', 'json', 'mqtt-smarthome', 'homeassistant-mqtt', 'gladys-mqtt', 'thingsboard-json', 'thingsboard-gateway', 'wirenboard-mqtt']
+
+# Argparse
+parser = argparse.ArgumentParser(description=project_name, epilog='For further details see: ' + project_url)
+parser.add_argument('--sensors', help='comma separated numbers of simulated sensors to benchmark', default='1,10,50,100,500')
+parser.add_argument('--modes', help='comma separated reporting methods to benchmark', default=','.join(reporting_modes))
+parser.add_argument('--adapters', help='comma separated bluetooth adapters to distribute the sensors over', default='hci0')
+parser.add_argument('--adapter_concurrency', help='simultaneous connections per adapter', type=int, default=1)
+parser.add_argument('--connect_latency', help='mean time in seconds to connect to a simulated sensor', type=float, default=0.1)
+parser.add_argument('--connect_jitter', help='maximum deviation in seconds from the mean connect time', type=float, default=0.05)
+parser.add_argument('--read_latency', help='time in seconds per simulated GATT operation', type=float, default=0.01)
+parser.add_argument('--failure_rate', help='share of failing simulated connections, 0.0 - 1.0', type=float, default=0.0)
+parser.add_argument('--broker_latency', help='time in seconds for the simulated broker to acknowledge a message', type=float, default=0.005)
+parser.add_argument('--output', help='file to store the results in', default='benchmark-results.json')
+parser.add_argument('--compare', help='results of an earlier run to compare against')
+parser.add_argument('--tolerance', help='relative slowdown reported as regression', type=float, default=0.1)
+parser.add_argument('--timeout', help='maximum time in seconds per benchmark run', type=int, default=3600)
+parse_args = parser.parse_args()
+
+daemon_path = os.path.join(sys.path[0], 'miflora-mqtt-daemon.py')
+
+# Logging function
+def print_line(text, error=False, warning=False):
+    timestamp = strftime('%Y-%m-%d %H:%M:%S', localtime())
+    if error:
+        print(Fore.RED + Style.BRIGHT + '[{}] '.format(timestamp) + Style.RESET_ALL + '{}'.format(text) + Style.RESET_ALL, file=sys.stderr)
+    elif warning:
+        print(Fore.YELLOW + '[{}] '.format(timestamp) + Style.RESET_ALL + '{}'.format(text) + Style.RESET_ALL)
+    else:
+        print(Fore.GREEN + '[{}] '.format(timestamp) + Style.RESET_ALL + '{}'.format(text) + Style.RESET_ALL)
+
+# Configuration of one non-daemon run polling every simulated sensor once
+def benchmark_config(reporting_mode, sensors):
+    lines = [
+        '[General]',
+        'reporting_method = {}'.format(reporting_mode),
+        'backend = simulation',
+        'adapters = {}'.format(parse_args.adapters),
+        'adapter_concurrency = {}'.format(parse_args.adapter_concurrency),
+        '',
+        '[Daemon]',
+        'enabled = false',
+        '',
+        '[MQTT]',
+        'simulation = true',
+        '',
+        '[Simulation]',
+        'connect_latency = {}'.format(parse_args.connect_latency),
+        'connect_jitter = {}'.format(parse_args.connect_jitter),
+        'read_latency = {}'.format(parse_args.read_latency),
+        'failure_rate = {}'.format(parse_args.failure_rate),
+        'broker_latency = {}'.format(parse_args.broker_latency),
+        '',
+        '[Sensors]',
+    ]
+    for index in range(sensors):
+        lines.append('Simulated{:03d}@Benchmark = C4:7C:8D:{:02X}:{:02X}:{:02X}'.format(index, index >> 16 & 0xFF, index >> 8 & 0xFF, index & 0xFF))
+    return '\n'.join(lines) + '\n'
+
+def run_benchmark(reporting_mode, sensors):
+    with TemporaryDirectory() as config_dir:
+        with open(os.path.join(config_dir, 'config.ini'), 'w') as config_file:
+            config_file.write(benchmark_config(reporting_mode, sensors))
+        stats_path = os.path.join(config_dir, 'stats.json')
+        try:
+            process = subprocess.run([sys.executable, daemon_path, '--config_dir', config_dir, '--stats_file', stats_path],
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=parse_args.timeout)
+        except subprocess.TimeoutExpired:
+            print_line('Benchmark of {} with {} sensor(s) timed out'.format(reporting_mode, sensors), error=True)
+            return None
+        if process.returncode != 0 or not os.path.exists(stats_path):
+            print_line('Benchmark of {} with {} sensor(s) failed:\n{}'.format(reporting_mode, sensors, process.stderr.decode('utf-8', 'replace')), error=True)
+            return None
+        with open(stats_path) as stats_file:
+            return json.load(stats_file, object_pairs_hook=OrderedDict)
+
+# Compare with the results of an earlier run, returns the number of regressions
+def compare_results(results, baseline):
+    earlier = {(stats['reporting_method'], stats['sensors']): stats for stats in baseline['results']}
+    regressions = 0
+    for stats in results:
+        before = earlier.get((stats['reporting_method'], stats['sensors']))
+        if before is None:
+            continue
+        for [key, higher_is_better] in [('cycle_seconds', False), ('startup_seconds', False), ('publishes_per_second', True), ('peak_rss_kb', False), ('peak_threads', False)]:
+            if not before[key]:
+                continue
+            change = stats[key] / before[key] - 1
+            if (change < -parse_args.tolerance) if higher_is_better else (change > parse_args.tolerance):
+                print_line('{} with {} sensor(s): {} regressed from {} to {} ({:+.0%})'.format(
+                    stats['reporting_method'], stats['sensors'], key, before[key], stats[key], change), warning=True)
+                regressions += 1
+    return regressions
+
+# Intro
+colorama_init()
+print(Fore.GREEN + Style.BRIGHT)
+print(project_name)
+print('Source:', project_url)
+print(Style.RESET_ALL)
+
+results = []
+columns = ['reporting_method', 'sensors', 'startup_seconds', 'cycle_seconds', 'publishes_per_second', 'peak_rss_kb', 'peak_threads', 'polls_failed']
+print(' '.join('{:>20}'.format(column) for column in columns))
+for reporting_mode in [mode.strip() for mode in parse_args.modes.split(',') if mode.strip()]:
+    for sensors in [int(count) for count in parse_args.sensors.split(',') if count.strip()]:
+        stats = run_benchmark(reporting_mode, sensors)
+        if stats is not None:
+            print(' '.join('{:>20}'.format(stats[column]) for column in columns))
+            results.append(stats)
+
+settings = OrderedDict((key, value) for [key, value] in sorted(vars(parse_args).items()) if key not in ['output', 'compare', 'tolerance', 'timeout'])
+with open(parse_args.output, 'w') as results_file:
+    json.dump(OrderedDict([('date', strftime('%Y-%m-%dT%H:%M:%S%z', localtime())), ('settings', settings), ('results', results)]), results_file, indent=2)
+print_line('Results of {} benchmark run(s) stored in "{}"'.format(len(results), parse_args.output))
+
+if parse_args.compare:
+    with open(parse_args.compare) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get('settings') != settings:
+        print_line('Results in "{}" were taken with different settings'.format(parse_args.compare), warning=True)
+    regressions = compare_results(results, baseline)
+    if regressions:
+        print_line('{} regression(s) compared to "{}"'.format(regressions, parse_args.compare), error=True)
+        sys.exit(1)
+    print_line('No regressions compared to "{}"'.format(parse_args.compare))
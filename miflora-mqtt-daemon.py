@@ -6,31 +6,64 @@ import re
 import json
 import os.path
 import argparse
+import resource
+from struct import pack, unpack
+from array import array
+from math import isnan
 from time import time, sleep, localtime, strftime
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from heapq import heappush, heappop, heapify
+from random import uniform, Random
+from threading import Thread, Condition, Event, Lock, active_count
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
 from colorama import init as colorama_init
 from colorama import Fore, Back, Style
-from configparser import ConfigParser
+from configparser import ConfigParser, Error as ConfigParserError
 from unidecode import unidecode
-from miflora.miflora_poller import MiFloraPoller, MI_BATTERY, MI_CONDUCTIVITY, MI_LIGHT, MI_MOISTURE, MI_TEMPERATURE
+from miflora.miflora_poller import HistoryEntry, MI_BATTERY, MI_CONDUCTIVITY, MI_LIGHT, MI_MOISTURE, MI_TEMPERATURE
 from btlewrap import BluepyBackend, GatttoolBackend, BluetoothBackendException
-from bluepy.btle import BTLEException
+from btlewrap.base import AbstractBackend
+from bluepy.btle import BTLEException, DefaultDelegate, Scanner, ScanEntry
 import paho.mqtt.client as mqtt
 import sdnotify
-from signal import signal, SIGPIPE, SIG_DFL
+from signal import signal, SIGPIPE, SIGHUP, SIG_DFL
 signal(SIGPIPE,SIG_DFL)
 
 project_name = 'Xiaomi Mi Flora Plant Sensor MQTT Client/Daemon'
 project_url = 'https://github.com/ThomDietrich/miflora-mqtt-daemon'
+homie_bridge_id = 'miflora-mqtt-daemon'
 
 parameters = OrderedDict([
-    (MI_LIGHT, dict(name="LightIntensity", name_pretty='Sunlight Intensity', typeformat='%d', unit='lux', device_class="illuminance", state_class="measurement")),
-    (MI_TEMPERATURE, dict(name="AirTemperature", name_pretty='Air Temperature', typeformat='%.1f', unit='°C', device_class="temperature", state_class="measurement")),
-    (MI_MOISTURE, dict(name="SoilMoisture", name_pretty='Soil Moisture', typeformat='%d', unit='%', device_class="humidity", state_class="measurement")),
-    (MI_CONDUCTIVITY, dict(name="SoilConductivity", name_pretty='Soil Conductivity/Fertility', typeformat='%d', unit='µS/cm', state_class="measurement")),
-    (MI_BATTERY, dict(name="Battery", name_pretty='Sensor Battery Level', typeformat='%d', unit='%', device_class="battery", state_class="measurement"))
+    (MI_LIGHT, dict(name="LightIntensity", name_pretty='Sunlight Intensity', typeformat='%d', unit='lux', device_class="illuminance", state_class="measurement", homie_format='0:50000')),
+    (MI_TEMPERATURE, dict(name="AirTemperature", name_pretty='Air Temperature', typeformat='%.1f', unit='°C', device_class="temperature", state_class="measurement", homie_format='*')),
+    (MI_MOISTURE, dict(name="SoilMoisture", name_pretty='Soil Moisture', typeformat='%d', unit='%', device_class="humidity", state_class="measurement", homie_format='0:100')),
+    (MI_CONDUCTIVITY, dict(name="SoilConductivity", name_pretty='Soil Conductivity/Fertility', typeformat='%d', unit='µS/cm', state_class="measurement", homie_format='0:*')),
+    (MI_BATTERY, dict(name="Battery", name_pretty='Sensor Battery Level', typeformat='%d', unit='%', device_class="battery", state_class="measurement", homie_format='0:100'))
 ])
 
+# Mi Flora GATT handles, as used by miflora.miflora_poller
+HANDLE_READ_VERSION_BATTERY = 0x38
+HANDLE_READ_NAME = 0x03
+HANDLE_READ_SENSOR_DATA = 0x35
+HANDLE_WRITE_MODE_CHANGE = 0x33
+DATA_MODE_CHANGE = bytes([0xA0, 0x1F])
+HANDLE_DEVICE_TIME = 0x41
+HANDLE_HISTORY_CONTROL = 0x3E
+HANDLE_HISTORY_READ = 0x3C
+CMD_HISTORY_READ_INIT = bytes([0xA0, 0x00, 0x00])
+INVALID_HISTORY_DATA = [bytes([0xFF] * 16), bytes([0x00] * 16)]
+
+# MiBeacon advertisement service data (UUID 0xFE95) object types
+MIBEACON_UUID = bytes([0x95, 0xFE])
+MIBEACON_OBJECTS = {
+    0x1004: (MI_TEMPERATURE, lambda value: int.from_bytes(value[0:2], 'little', signed=True) / 10.0),
+    0x1007: (MI_LIGHT, lambda value: int.from_bytes(value[0:3], 'little')),
+    0x1008: (MI_MOISTURE, lambda value: value[0]),
+    0x1009: (MI_CONDUCTIVITY, lambda value: int.from_bytes(value[0:2], 'little')),
+    0x100A: (MI_BATTERY, lambda value: value[0]),
+}
+
 if False:
     # will be caught by python 2.7 to be illegal syntax
     print('Sorry, this script requires a python3 runtime environment.', file=sys.stderr)
@@ -38,7 +71,10 @@ if False:
 # Argparse
 parser = argparse.ArgumentParser(description=project_name, epilog='For further details see: ' + project_url)
 parser.add_argument('--config_dir', help='set directory where config.ini is located', default=sys.path[0])
+parser.add_argument('--state_dir', help='set directory for the state files like the device cache (default: $STATE_DIRECTORY as set by systemd, else the config_dir)')
+parser.add_argument('--stats_file', help='write cycle time, publish rate, peak memory and thread count as json to this file when finishing in non-daemon-mode')
 parse_args = parser.parse_args()
+daemon_start = time()
 
 # Intro
 colorama_init()
@@ -72,23 +108,1601 @@ def clean_identifier(name):
     clean = unidecode(clean)
     return clean
 
+# Sensor entry parsing, "MAC[, option=value, ...]"
+def parse_sensor_entry(entry):
+    mac, *options = [part.strip() for part in entry.split(',')]
+    sensor_options = dict()
+    for option in options:
+        key, _, value = option.partition('=')
+        if not key.strip() or not value.strip():
+            raise ValueError('Invalid sensor option "{}"'.format(option))
+        sensor_options[key.strip()] = value.strip()
+    return mac, sensor_options
+
+# Histograms and counters of the hot paths, exposed in the Prometheus text format
+class Metrics:
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = OrderedDict()
+        self.counters = OrderedDict()
+
+    def histogram(self, name, description, buckets):
+        self.histograms[name] = (description, buckets, OrderedDict())
+
+    def counter(self, name, description):
+        self.counters[name] = (description, OrderedDict())
+
+    def observe(self, name, value, **labels):
+        _, buckets, series = self.histograms[name]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = series.setdefault(key, [0] * (len(buckets) + 2))
+            for [index, bound] in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def inc(self, name, **labels):
+        _, series = self.counters[name]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series[key] = series.get(key, 0) + 1
+
+    @staticmethod
+    def format_labels(key, extra=()):
+        labels = ['{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                  for [label, value] in list(key) + list(extra)]
+        return '{' + ','.join(labels) + '}' if labels else ''
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for [name, [description, buckets, series]] in self.histograms.items():
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} histogram'.format(name))
+                for [key, counts] in series.items():
+                    for [index, bound] in enumerate(buckets):
+                        lines.append('{}_bucket{} {}'.format(name, self.format_labels(key, [('le', bound)]), counts[index]))
+                    lines.append('{}_bucket{} {}'.format(name, self.format_labels(key, [('le', '+Inf')]), counts[-1]))
+                    lines.append('{}_sum{} {}'.format(name, self.format_labels(key), counts[-2]))
+                    lines.append('{}_count{} {}'.format(name, self.format_labels(key), counts[-1]))
+            for [name, [description, series]] in self.counters.items():
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} counter'.format(name))
+                for [key, count] in series.items():
+                    lines.append('{}{} {}'.format(name, self.format_labels(key), count))
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        stats = OrderedDict()
+        with self.lock:
+            for [name, [_, _, series]] in self.histograms.items():
+                stats[name] = [dict(key, count=counts[-1], sum=round(counts[-2], 3)) for [key, counts] in series.items()]
+            for [name, [_, series]] in self.counters.items():
+                stats[name] = [dict(key, count=count) for [key, count] in series.items()]
+        return stats
+
+metrics = Metrics()
+metrics.histogram('miflora_ble_connect_seconds', 'Time to establish the BLE connection to a sensor, by result', [0.25, 0.5, 1, 2, 5, 10, 20])
+metrics.histogram('miflora_read_seconds', 'Duration of a complete sensor read over BLE, by result', [0.5, 1, 2, 5, 10, 20, 40])
+metrics.histogram('miflora_read_retries', 'Retries per sensor read, by result', [0, 1, 2])
+metrics.histogram('miflora_publish_ack_seconds', 'Time from publishing a reading to its acknowledgement by the broker', [0.01, 0.05, 0.1, 0.25, 0.5, 1, 5])
+metrics.histogram('miflora_cycle_seconds', 'Duration of a polling cycle', [1, 5, 10, 30, 60, 120, 300, 600])
+metrics.histogram('miflora_schedule_lateness_seconds', 'Delay between the scheduled and the actual start of a sensor poll', [0.1, 1, 5, 10, 30, 60, 300])
+metrics.counter('miflora_polls_total', 'Sensor polls by result')
+metrics.counter('miflora_passive_fallbacks_total', 'Connections in passive mode for values not advertised in time, by result')
+
+# Serves the metrics on /metrics
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Immutable result of one sensor read, the values in the fields named after the parameters
+class FloraReading(namedtuple('FloraReading', ['timestamp', 'device_name', 'firmware'] + list(parameters))):
+    __slots__ = ()
+
+    # The values read, parameters without a value are left out
+    def data(self):
+        return OrderedDict((param, getattr(self, param)) for param in parameters if getattr(self, param) is not None)
+
+# Sensor data retrieval over one BLE connection per read
+# Talks to the backend directly, btlewrap serializes all connections of the process through a single lock
+class FloraReader:
+    def __init__(self, mac, backend, adapter, name):
+        self.mac = mac
+        self.backend = backend(adapter=adapter)
+        self.adapter = adapter
+        self.name = name
+        # device name and firmware version, kept from the last read
+        self.device_name = None
+        self.firmware = None
+
+    # Firmware and battery, the realtime data and the device name if not known yet
+    def read(self):
+        started = time()
+        # failed reads are observed too, they are the slow ones
+        result = connected = 'error'
+        try:
+            try:
+                self.backend.connect(self.mac)
+                connected = 'success'
+            finally:
+                metrics.observe('miflora_ble_connect_seconds', time() - started, sensor=self.name, adapter=self.adapter, result=connected)
+            try:
+                version_battery = self.backend.read_handle(HANDLE_READ_VERSION_BATTERY)
+                if version_battery is None:
+                    raise BluetoothBackendException('Could not read firmware version from Mi Flora sensor {}'.format(self.mac))
+                firmware = ''.join(map(chr, version_battery[2:]))
+                if firmware >= '2.6.6':
+                    # for the newer models a magic number must be written before we can read the current data
+                    self.backend.write_handle(HANDLE_WRITE_MODE_CHANGE, DATA_MODE_CHANGE)
+                sensor_data = self.backend.read_handle(HANDLE_READ_SENSOR_DATA)
+                device_name = self.device_name
+                if device_name is None:
+                    device_name = ''.join(map(chr, self.backend.read_handle(HANDLE_READ_NAME) or b''))
+            finally:
+                self.backend.disconnect()
+
+            if not sensor_data or len(sensor_data) not in [16, 24] or sensor_data[7] > 100 or sum(sensor_data) == 0 \
+                    or (firmware >= '2.6.6' and sum(sensor_data[10:]) == 0):
+                raise BluetoothBackendException('Invalid data received from Mi Flora sensor {}'.format(self.mac))
+            result = 'success'
+        finally:
+            metrics.observe('miflora_read_seconds', time() - started, sensor=self.name, adapter=self.adapter, result=result)
+
+        values = dict()
+        if len(sensor_data) == 24:
+            # RoPot sensors do not report light
+            temperature, values[MI_MOISTURE], values[MI_CONDUCTIVITY] = unpack('<hxxxxxBhxxxxxxxxxxxxxx', sensor_data)
+            values[MI_LIGHT] = False
+        else:
+            temperature, values[MI_LIGHT], values[MI_MOISTURE], values[MI_CONDUCTIVITY] = unpack('<hxIBhxxxxxx', sensor_data)
+        values[MI_TEMPERATURE] = temperature / 10.0
+        values[MI_BATTERY] = version_battery[0]
+        self.device_name, self.firmware = device_name, firmware
+        return FloraReading(timestamp=time(), device_name=device_name, firmware=firmware, **values)
+
+    # Bulk download of the hourly history log, starting at the cursor position
+    # Stops at the first entry which can't be read, like miflora's fill_history, keeping the entries read before
+    def read_history(self, start, max_entries):
+        entries = []
+        self.backend.connect(self.mac)
+        try:
+            self.backend.write_handle(HANDLE_HISTORY_CONTROL, CMD_HISTORY_READ_INIT)
+            history_info = self.backend.read_handle(HANDLE_HISTORY_READ)
+            if not history_info or len(history_info) < 2:
+                raise BluetoothBackendException('Invalid history length received from Mi Flora sensor {}'.format(self.mac))
+            history_length = int.from_bytes(history_info[0:2], 'little')
+            # the device time first, to place the entries read before a failure
+            requested = time()
+            device_time = self.backend.read_handle(HANDLE_DEVICE_TIME)
+            wall_time = (requested + time()) / 2
+            if not device_time or len(device_time) < 4:
+                raise BluetoothBackendException('Invalid device time received from Mi Flora sensor {}'.format(self.mac))
+            device_time = int.from_bytes(device_time[0:4], 'little')
+            if start > history_length:
+                # history was cleared or the sensor was reset, start over
+                start = 0
+            end = min(history_length, start + max_entries)
+            for index in range(start, end):
+                try:
+                    self.backend.write_handle(HANDLE_HISTORY_CONTROL, bytes([0xA1]) + index.to_bytes(2, 'little'))
+                    response = self.backend.read_handle(HANDLE_HISTORY_READ)
+                    if response not in INVALID_HISTORY_DATA:
+                        entries.append(HistoryEntry(response))
+                except (IOError, BluetoothBackendException, BTLEException, RuntimeError, BrokenPipeError, IndexError, TypeError, ValueError) as e:
+                    print_line('Reading history entry {} of Mi Flora sensor {} failed, continuing later: {}'.format(index, self.mac, e), warning=True)
+                    end = index
+                    break
+        finally:
+            self.backend.disconnect()
+
+        history = []
+        for entry in entries:
+            data = OrderedDict()
+            for param,_ in parameters.items():
+                if getattr(entry, param, None) is not None:
+                    data[param] = getattr(entry, param)
+            history.append((entry.device_time + wall_time - device_time, data))
+        return end, history_length, history
+
+def poll_flora_history(flora):
+    cursor = history_cursors.get(flora['mac'], 0)
+    print_line('Retrieving history of sensor "{}" from entry {} ...'.format(flora['name_pretty'], cursor))
+    try:
+        return flora['reader'].read_history(cursor, history_max_entries)
+    except (IOError, BluetoothBackendException, BTLEException, RuntimeError, BrokenPipeError) as e:
+        print_line('Failed to retrieve history of sensor "{}" due to exception: {}'.format(flora['name_pretty'], e), error=True)
+    return None
+
+def poll_flora_gatt(flora):
+    # no retries for sensors already failing, a second timeout would only delay the others
+    attempts = 2 if flora['stats']['health'] == 'healthy' else 1
+    print_line('Retrieving data from sensor "{}" via {} ...'.format(flora['name_pretty'], flora['adapter']))
+    for retries in range(attempts):
+        try:
+            reading = flora['reader'].read()
+            metrics.observe('miflora_read_retries', retries, sensor=flora['name'], adapter=flora['adapter'], result='success')
+            return reading
+        except (IOError, BluetoothBackendException, BTLEException, RuntimeError, BrokenPipeError) as e:
+            if retries + 1 < attempts:
+                if len(str(e)) > 0:
+                    print_line('Retrying due to exception: {}'.format(e), error=True)
+                else:
+                    print_line('Retrying ...', warning=True)
+    metrics.observe('miflora_read_retries', attempts - 1, sensor=flora['name'], adapter=flora['adapter'], result='error')
+    return None
+
+def poll_flora(flora):
+    if daemon_mode != 'passive':
+        return poll_flora_gatt(flora)
+
+    # Use advertised values, fall back to a GATT connection for values not seen within their deadline
+    now = time()
+    data = OrderedDict()
+    missing = []
+    for param,_ in parameters.items():
+        value, timestamp = flora['advertised'].get(param, (None, 0))
+        deadline = passive_battery_timeout if param == MI_BATTERY else passive_timeout
+        if now - timestamp > deadline:
+            missing.append(param)
+        data[param] = value
+    if not missing:
+        return FloraReading(timestamp=now, device_name=flora['reader'].device_name, firmware=flora['reader'].firmware, **data)
+
+    print_line('No recent advertisement of {} from sensor "{}", falling back to connection'.format(', '.join(missing), flora['name_pretty']))
+    reading = poll_flora_gatt(flora)
+    metrics.inc('miflora_passive_fallbacks_total', sensor=flora['name'], adapter=flora['adapter'], result='failure' if reading is None else 'success')
+    if reading is None:
+        # in advertising range but not in reach of a connection, the recent values are still worth publishing
+        fresh = [param for param in parameters if param not in missing]
+        if not fresh:
+            return None
+        print_line('Connection to sensor "{}" failed, publishing the advertised {} only'.format(flora['name_pretty'], ', '.join(fresh)), warning=True)
+        for param in missing:
+            data[param] = None
+        return FloraReading(timestamp=now, device_name=flora['reader'].device_name, firmware=flora['reader'].firmware, **data)
+    # the connection read is newer than any advertisement, which only fills values it didn't return
+    gatt_data = reading.data()
+    for [param, value] in gatt_data.items():
+        flora['advertised'][param] = (value, reading.timestamp)
+    advertised = dict((param, data[param]) for param in parameters if param not in gatt_data and param not in missing)
+    return reading._replace(**advertised)
+
+# Decode the objects of a MiBeacon advertisement frame
+def parse_mibeacon(service_data):
+    values = dict()
+    if len(service_data) < 7 or service_data[0:2] != MIBEACON_UUID:
+        return values
+    frame = service_data[2:]
+    frame_control = int.from_bytes(frame[0:2], 'little')
+    if frame_control & 0x08 or not frame_control & 0x40:
+        # encrypted or without object payload
+        return values
+    offset = 5
+    if frame_control & 0x10:
+        offset += 6
+    if frame_control & 0x20:
+        if offset < len(frame) and frame[offset] & 0x20:
+            offset += 2
+        offset += 1
+    while offset + 3 <= len(frame):
+        object_type = int.from_bytes(frame[offset:offset + 2], 'little')
+        length = frame[offset + 2]
+        value = frame[offset + 3:offset + 3 + length]
+        offset += 3 + length
+        if object_type in MIBEACON_OBJECTS and len(value) == length:
+            param, decode = MIBEACON_OBJECTS[object_type]
+            values[param] = decode(value)
+    return values
+
+# Continuous BLE scan recording the values advertised by the configured sensors
+class AdvertisementListener(DefaultDelegate):
+    def __init__(self, adapter):
+        DefaultDelegate.__init__(self)
+        self.adapter = adapter
+
+    def handleDiscovery(self, scanEntry, isNewDev, isNewData):
+        flora = flores_by_mac.get(scanEntry.addr.lower())
+        if flora is None:
+            return
+        now = time()
+        # the adapter receiving the sensor best, until it loses it
+        if flora['rssi_adapter'] == self.adapter or flora['rssi'] is None or scanEntry.rssi > flora['rssi'] \
+                or now - flora['seen'] > passive_timeout:
+            flora['rssi'], flora['rssi_adapter'] = scanEntry.rssi, self.adapter
+        flora['seen'] = now
+        if not isNewData:
+            return
+        for [param, value] in parse_mibeacon(scanEntry.getValue(ScanEntry.SERVICE_DATA_16B) or b'').items():
+            flora['advertised'][param] = (value, now)
+
+    def run(self):
+        scanner = Scanner(int(self.adapter[3:])).withDelegate(self)
+        while True:
+            try:
+                scanner.start(passive=True)
+                while True:
+                    scanner.process(60)
+                    scanner.clear()
+            except (IOError, BTLEException, RuntimeError, BrokenPipeError) as e:
+                print_line('Advertisement scan on {} failed due to exception: {}'.format(self.adapter, e), error=True)
+            try:
+                scanner.stop()
+            except (IOError, BTLEException, RuntimeError, BrokenPipeError):
+                pass
+            sleep(5.0)
+
+# Short BLE scan on an adapter, the signal strength of the configured sensors seen
+def scan_adapter(adapter, duration):
+    if ble_backend == 'simulation':
+        return SimulatedBackend.scan(adapter, duration, list(flores_by_mac))
+    entries = Scanner(int(adapter[3:])).scan(duration, passive=True)
+    return {entry.addr.lower(): entry.rssi for entry in entries if entry.addr.lower() in flores_by_mac}
+
+# Shared presence scan on all adapters at once before a wave of polls, a sensor not seen by any of them is absent
+# The presence of all sensors stays unknown if a scan fails
+def scan_presence():
+    results = dict()
+    def scan(adapter):
+        try:
+            results[adapter] = scan_adapter(adapter, presence_scan)
+        except (IOError, BTLEException, RuntimeError, BrokenPipeError) as e:
+            print_line('Presence scan on {} failed due to exception: {}'.format(adapter, e), error=True)
+    print_line('Scanning for sensors on {} for {} seconds ...'.format(', '.join(used_adapters), presence_scan))
+    threads = [Thread(target=scan, args=(adapter,), daemon=True) for adapter in used_adapters]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    now = time()
+    for flora in flores.values():
+        flora['present'] = None if len(results) < len(used_adapters) else False
+        flora['scanned'] = now
+    for [adapter, seen] in results.items():
+        for [mac, rssi] in seen.items():
+            flora = flores_by_mac.get(mac)
+            if flora is None:
+                continue
+            if not flora['present'] or rssi > flora['rssi']:
+                flora['rssi'], flora['rssi_adapter'] = rssi, adapter
+            flora['present'] = True
+            flora['seen'] = now
+    if len(results) == len(used_adapters):
+        print_line('{} of {} sensor(s) seen by the presence scan'.format(sum(flora['present'] for flora in flores.values()), len(flores)))
+
+# Whether a sensor is in range, by the presence scan before the wave or the continuous advertisement scan in passive mode
+def flora_present(flora, now):
+    if daemon_mode == 'passive':
+        return now - flora['seen'] <= passive_timeout
+    # unknown for sensors added since the last scan, and after a period without a scan while others were still being polled
+    return flora['present'] is not False or now - flora['scanned'] > flora['refresh']
+
+# Polling worker, one or more per Bluetooth adapter
+# The jobs carry the sensor entry itself, a reload replacing the entry under the same name leaves the old job behind
+def adapter_worker(jobs, results):
+    while True:
+        flora_name, flora = jobs.get()
+        started = time()
+        if flores.get(flora_name) is not flora:
+            # removed or replaced by a reload while waiting
+            results.put((flora_name, flora, None, started, None))
+            continue
+        reading = history = None
+        try:
+            reading = poll_flora(flora)
+            if history_enabled and reading is not None and started >= flora['history_due']:
+                history = poll_flora_history(flora)
+        except Exception as e:
+            # counts as a failed poll, the worker keeps serving the other sensors of its adapter
+            print_line('Polling of sensor "{}" failed due to unexpected exception: {!r}'.format(flora['name_pretty'], e), error=True)
+        results.put((flora_name, flora, reading, started, history))
+
+# MQTT client waiting for broker acknowledgements instead of fixed delays
+# Keeps a bounded window of messages in flight, acknowledged through the on_publish callback
+class AckTrackingClient(mqtt.Client):
+    def __init__(self, *args, max_inflight=20, ack_timeout=5.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_inflight = max_inflight
+        self.ack_timeout = ack_timeout
+        self.ack_condition = Condition()
+        self.acks_pending = dict()
+        self.acks_early = dict()
+        self.ack_latencies = []
+        self.ack_failures = 0
+        self.ack_lost = 0
+        self.messages_published = 0
+        self.connection_established = Event()
+        # retained messages received while collecting, None otherwise
+        self.retained_snapshot = None
+        self.retained_received = 0.0
+        self.subscription_pending = False
+        # without loop_start() the network loop is driven while waiting
+        self.manual_loop = False
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if len(self.acks_pending) >= self.max_inflight:
+            self.wait_for_acks(lambda: len(self.acks_pending) < self.max_inflight)
+        published = time()
+        info = super().publish(topic, payload, qos, retain)
+        with self.ack_condition:
+            self.messages_published += 1
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.ack_failures += 1
+                self.ack_lost += 1
+            elif info.mid in self.acks_early:
+                # the acknowledgement overtook the return of publish()
+                self.ack_latencies.append(self.acks_early.pop(info.mid) - published)
+            else:
+                self.acks_pending[info.mid] = published
+        return info
+
+    def acknowledge(self, mid):
+        with self.ack_condition:
+            published = self.acks_pending.pop(mid, None)
+            if published is None:
+                self.acks_early[mid] = time()
+            else:
+                self.ack_latencies.append(time() - published)
+            self.ack_condition.notify_all()
+
+    def wait_for_acks(self, predicate=None):
+        done = predicate or (lambda: not self.acks_pending)
+        deadline = time() + self.ack_timeout
+        with self.ack_condition:
+            while not done() and time() < deadline:
+                if self.manual_loop:
+                    self.ack_condition.release()
+                    try:
+                        self.loop(0.05)
+                    finally:
+                        self.ack_condition.acquire()
+                else:
+                    self.ack_condition.wait(deadline - time())
+            # give up on messages not acknowledged in time
+            for [mid, published] in list(self.acks_pending.items()):
+                if time() - published >= self.ack_timeout:
+                    del self.acks_pending[mid]
+                    self.ack_failures += 1
+                    self.ack_lost += 1
+            for [mid, acknowledged] in list(self.acks_early.items()):
+                if time() - acknowledged >= self.ack_timeout:
+                    del self.acks_early[mid]
+            if predicate is not None:
+                return 0
+            # report the messages lost since the last complete wait
+            lost, self.ack_lost = self.ack_lost, 0
+            return lost
+
+    def wait_for_connection(self):
+        deadline = time() + self.ack_timeout
+        while not self.connection_established.is_set() and time() < deadline:
+            if self.manual_loop:
+                self.loop(0.05)
+            else:
+                self.connection_established.wait(deadline - time())
+        return self.connection_established.is_set()
+
+    # The retained messages on the given topic filters, collected until none arrived for the quiet period
+    def collect_retained(self, topic_filters, quiet):
+        with self.ack_condition:
+            self.retained_snapshot = dict()
+            self.subscription_pending = True
+        result, _ = self.subscribe([(topic_filter, 1) for topic_filter in topic_filters])
+        deadline = time() + self.ack_timeout
+        with self.ack_condition:
+            if result != mqtt.MQTT_ERR_SUCCESS:
+                self.subscription_pending = False
+                deadline = 0
+            while (self.subscription_pending or time() - self.retained_received < quiet) and time() < deadline:
+                self.ack_condition.wait(min(quiet, deadline - time()))
+            snapshot, self.retained_snapshot = self.retained_snapshot, None
+            complete = not self.subscription_pending
+        self.unsubscribe(list(topic_filters))
+        return snapshot if complete else None
+
+    def subscribed(self):
+        with self.ack_condition:
+            self.subscription_pending = False
+            self.retained_received = time()
+            self.ack_condition.notify_all()
+
+    def receive(self, message):
+        with self.ack_condition:
+            if self.retained_snapshot is not None and message.retain:
+                self.retained_snapshot[message.topic] = message.payload
+                self.retained_received = time()
+                self.ack_condition.notify_all()
+
+    def ack_statistics(self):
+        with self.ack_condition:
+            latencies, failures = self.ack_latencies, self.ack_failures
+            self.ack_latencies, self.ack_failures = [], 0
+        return latencies, failures
+
+# Bluetooth backend simulating Mi Flora sensors, for benchmarks and tests without hardware
+# Drop-in for the btlewrap backends, also usable as miflora's MiFloraPoller(backend=SimulatedBackend)
+class SimulatedBackend(AbstractBackend):
+    connect_latency = 1.0
+    connect_jitter = 0.5
+    read_latency = 0.05
+    failure_rate = 0.0
+    absence_rate = 0.0
+    history_entries = 24
+    ranges = {MI_LIGHT: (0, 20000), MI_TEMPERATURE: (15.0, 28.0), MI_MOISTURE: (10, 60), MI_CONDUCTIVITY: (100, 1500), MI_BATTERY: (20, 100)}
+    # device time of the simulated sensors, as seconds since their last reset
+    boot_time = time() - 10 * 24 * 3600
+
+    def __init__(self, adapter='hci0', address_type='public', **kwargs):
+        super().__init__(adapter, address_type, **kwargs)
+        self.mac = None
+        self.random = Random()
+        self.history_address = None
+
+    def connect(self, mac):
+        sleep(max(0.0, uniform(self.connect_latency - self.connect_jitter, self.connect_latency + self.connect_jitter)))
+        if self.random.random() < self.failure_rate:
+            raise BluetoothBackendException('Simulated connection failure to Mi Flora sensor {}'.format(mac))
+        self.mac = mac
+
+    def disconnect(self):
+        self.mac = None
+
+    def value(self, param):
+        low, high = self.ranges[param]
+        if isinstance(low, float) or isinstance(high, float):
+            return round(self.random.uniform(low, high), 1)
+        return self.random.randint(low, high)
+
+    def write_handle(self, handle, value):
+        if self.mac is None:
+            raise BluetoothBackendException('Not connected to a simulated Mi Flora sensor')
+        sleep(self.read_latency)
+        if handle == HANDLE_HISTORY_CONTROL:
+            self.history_address = None if value == CMD_HISTORY_READ_INIT else int.from_bytes(value[1:3], 'little')
+        return True
+
+    def read_handle(self, handle):
+        if self.mac is None:
+            raise BluetoothBackendException('Not connected to a simulated Mi Flora sensor')
+        sleep(self.read_latency)
+        if handle == HANDLE_READ_NAME:
+            return b'Flower care'
+        if handle == HANDLE_READ_VERSION_BATTERY:
+            return bytes([self.value(MI_BATTERY), 0x15]) + b'3.2.2'
+        if handle == HANDLE_READ_SENSOR_DATA:
+            # the trailing bytes of the newer firmware versions must not be empty
+            return pack('<hxIBh6s', int(self.value(MI_TEMPERATURE) * 10), self.value(MI_LIGHT), self.value(MI_MOISTURE),
+                        self.value(MI_CONDUCTIVITY), bytes([0x02, 0x3C, 0x00, 0xFB, 0x34, 0x9B]))
+        device_time = int(time() - self.boot_time)
+        if handle == HANDLE_DEVICE_TIME:
+            return device_time.to_bytes(4, 'little')
+        if handle == HANDLE_HISTORY_READ:
+            if self.history_address is None:
+                return self.history_entries.to_bytes(2, 'little') + bytes(14)
+            # hourly entries, the last one from the past full hour
+            entry_time = device_time - device_time % 3600 - (self.history_entries - 1 - self.history_address) * 3600
+            return pack('<Ihx', entry_time, int(self.value(MI_TEMPERATURE) * 10)) + self.value(MI_LIGHT).to_bytes(3, 'little') \
+                + pack('<xBHxx', self.value(MI_MOISTURE), self.value(MI_CONDUCTIVITY))
+        raise BluetoothBackendException('Handle 0x{:02x} not simulated'.format(handle))
+
+    @staticmethod
+    def check_backend():
+        return True
+
+    @staticmethod
+    def scan_for_devices(timeout, adapter='hci0'):
+        return []
+
+    # Scan for the sensors of the given MAC addresses, with a signal strength which stays about the same per sensor and adapter
+    @classmethod
+    def scan(cls, adapter, duration, macs):
+        sleep(duration)
+        return {mac: Random(mac + adapter).randint(-95, -45) + round(uniform(-3, 3)) for mac in macs if uniform(0, 1) >= cls.absence_rate}
+
+# MQTT client answering all network operations in-process, for benchmarks and tests without a broker
+# Acknowledges connections and published messages after a configurable latency through the usual callbacks
+class InProcessMqttClient(mqtt.Client):
+    ack_latency = 0.005
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.simulated_condition = Condition()
+        self.simulated_acks = []
+        self.simulated_mid = 0
+        self.simulated_connecting = False
+        self.simulated_loop = None
+        self.simulated_deliveries = []
+        self.retained = dict()
+
+    def connect(self, host, port=1883, keepalive=60, bind_address=''):
+        return self.reconnect()
+
+    def connect_async(self, host, port=1883, keepalive=60, bind_address=''):
+        self.simulated_connecting = True
+
+    def reconnect(self):
+        with self.simulated_condition:
+            self.simulated_connecting = True
+            self.simulated_condition.notify_all()
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        with self.simulated_condition:
+            self.simulated_mid += 1
+            info = mqtt.MQTTMessageInfo(self.simulated_mid)
+            heappush(self.simulated_acks, (time() + self.ack_latency, self.simulated_mid))
+            if retain and payload in [None, '', b'']:
+                self.retained.pop(topic, None)
+            elif retain:
+                self.retained[topic] = payload if isinstance(payload, bytes) else str(payload).encode('utf-8')
+            self.simulated_condition.notify_all()
+        return info
+
+    def subscribe(self, topic, qos=0):
+        topic_filters = [topic_filter for [topic_filter, _] in topic] if isinstance(topic, list) else [topic]
+        with self.simulated_condition:
+            self.simulated_mid += 1
+            # the retained messages follow the acknowledgement of the subscription
+            messages = [(topic_name, payload) for [topic_name, payload] in self.retained.items()
+                        if any(mqtt.topic_matches_sub(topic_filter, topic_name) for topic_filter in topic_filters)]
+            self.simulated_deliveries.append((time() + self.ack_latency, self.simulated_mid, messages))
+            self.simulated_condition.notify_all()
+            return mqtt.MQTT_ERR_SUCCESS, self.simulated_mid
+
+    def unsubscribe(self, topic):
+        with self.simulated_condition:
+            self.simulated_mid += 1
+            return mqtt.MQTT_ERR_SUCCESS, self.simulated_mid
+
+    def loop(self, timeout=1.0, max_packets=1):
+        with self.simulated_condition:
+            if not self.simulated_connecting:
+                wakeup = [self.simulated_acks[0][0]] if self.simulated_acks else []
+                wakeup += [delivery[0] for delivery in self.simulated_deliveries]
+                wait = min(wakeup) - time() if wakeup else timeout
+                if wait > 0:
+                    self.simulated_condition.wait(min(wait, timeout))
+            connecting, self.simulated_connecting = self.simulated_connecting, False
+            acknowledged = []
+            while self.simulated_acks and self.simulated_acks[0][0] <= time():
+                acknowledged.append(heappop(self.simulated_acks)[1])
+            deliveries = [delivery for delivery in self.simulated_deliveries if delivery[0] <= time()]
+            self.simulated_deliveries = [delivery for delivery in self.simulated_deliveries if delivery[0] > time()]
+        if connecting and self.on_connect:
+            self.on_connect(self, self._userdata, {'session present': 0}, 0)
+        for mid in acknowledged:
+            if self.on_publish:
+                self.on_publish(self, self._userdata, mid)
+        for [_, mid, messages] in deliveries:
+            if self.on_subscribe:
+                self.on_subscribe(self, self._userdata, mid, (1,))
+            for [topic, payload] in messages:
+                message = mqtt.MQTTMessage(topic=topic.encode('utf-8'))
+                message.payload = payload
+                message.retain = True
+                if self.on_message:
+                    self.on_message(self, self._userdata, message)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        def loop_forever():
+            while self.simulated_loop is not None:
+                self.loop(0.1)
+        self.simulated_loop = Thread(target=loop_forever, daemon=True)
+        self.simulated_loop.start()
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_stop(self, force=False):
+        self.simulated_loop = None
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def disconnect(self):
+        if self.on_disconnect:
+            self.on_disconnect(self, self._userdata, 0)
+        return mqtt.MQTT_ERR_SUCCESS
+
+class SimulatedMqttClient(AckTrackingClient, InProcessMqttClient):
+    pass
+
+# Append-only on-disk journal of readings which could not be published, replayed after reconnecting
+class ReadingsJournal:
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.failed = False
+
+    # A full disk or missing permissions lose the reading but don't stop the daemon, logged once until writing works again
+    def append(self, flora_name, timestamp, data):
+        line = json.dumps({'ts': timestamp, 'sensor': flora_name, 'data': data}) + '\n'
+        try:
+            with open(self.path, 'a', encoding='utf-8') as journal_file:
+                journal_file.write(line)
+            self.size += len(line.encode('utf-8'))
+            if self.size > self.max_size:
+                self.evict()
+        except OSError as e:
+            if not self.failed:
+                print_line('Readings journal "{}" could not be written, dropping readings: {}'.format(self.path, e), error=True, sd_notify=True)
+            self.failed = True
+            return
+        if self.failed:
+            print_line('Readings journal "{}" written again'.format(self.path))
+        self.failed = False
+
+    def lines(self):
+        with open(self.path, encoding='utf-8') as journal_file:
+            return journal_file.readlines()
+
+    def rewrite(self, lines):
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as journal_file:
+            journal_file.writelines(lines)
+        os.replace(self.path + '.tmp', self.path)
+        self.size = sum(len(line.encode('utf-8')) for line in lines)
+
+    def evict(self):
+        # drop the oldest readings, leaving some headroom to not rewrite on every append
+        lines = self.lines()
+        size = sum(len(line.encode('utf-8')) for line in lines)
+        dropped = 0
+        while lines and size > 0.9 * self.max_size:
+            size -= len(lines.pop(0).encode('utf-8'))
+            dropped += 1
+        self.rewrite(lines)
+        print_line('Readings journal full, dropped the {} oldest reading(s)'.format(dropped), warning=True)
+
+    def read(self, count):
+        entries = []
+        lines = self.lines()[:count]
+        for line in lines:
+            try:
+                entries.append(json.loads(line, object_pairs_hook=OrderedDict))
+            except ValueError:
+                # incomplete line of an interrupted write
+                pass
+        return entries, len(lines)
+
+    def drop(self, count):
+        try:
+            self.rewrite(self.lines()[count:])
+        except OSError as e:
+            print_line('Readings journal "{}" could not be rewritten, the replayed readings are sent again: {}'.format(self.path, e), error=True)
+
+# Fixed-size ring of time buckets holding count, sum, minimum, maximum and time integral of the values per bucket
+# A window aggregate combines the buckets of its span, the memory does not grow with the uptime
+class AggregateRing:
+    fields = ['start', 'count', 'total', 'minimum', 'maximum', 'integral']
+
+    def __init__(self, bucket_seconds, buckets):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        # one slot more than the window, its oldest bucket is only partly within the window
+        self.slots = buckets + 1
+        for field in self.fields:
+            setattr(self, field, array('d', [0.0] * self.slots))
+
+    def add(self, timestamp, value, integral):
+        start = timestamp - timestamp % self.bucket_seconds
+        index = int(start // self.bucket_seconds) % self.slots
+        if self.start[index] != start:
+            if self.start[index] > start:
+                # older than the span of the ring
+                return
+            self.start[index], self.count[index], self.total[index], self.integral[index] = start, 0.0, 0.0, 0.0
+            self.minimum[index] = self.maximum[index] = value
+        self.count[index] += 1
+        self.total[index] += value
+        self.minimum[index] = min(self.minimum[index], value)
+        self.maximum[index] = max(self.maximum[index], value)
+        self.integral[index] += integral
+
+    # Minimum, maximum, mean, number of samples and time integral of the buckets within the span, None without samples
+    # The bucket reaching past the start of the span is weighted by its overlap with it
+    def aggregate(self, now):
+        oldest = now - self.bucket_seconds * self.buckets
+        weights = dict()
+        for index in range(self.slots):
+            overlap = (self.start[index] + self.bucket_seconds - oldest) / self.bucket_seconds
+            if self.count[index] and overlap > 0:
+                weights[index] = min(overlap, 1.0)
+        if not weights:
+            return None
+        count = sum(self.count[index] * weight for [index, weight] in weights.items())
+        return OrderedDict([
+            ('min', min(self.minimum[index] for index in weights)),
+            ('max', max(self.maximum[index] for index in weights)),
+            ('mean', round(sum(self.total[index] * weight for [index, weight] in weights.items()) / count, 2)),
+            ('samples', int(round(count))),
+            ('integral', sum(self.integral[index] * weight for [index, weight] in weights.items())),
+        ])
+
+    def state(self):
+        return OrderedDict((field, getattr(self, field).tolist()) for field in self.fields)
+
+    # The buckets are placed by their start, so a ring saved with another number of slots still loads
+    def load(self, state):
+        saved = [state[field] for field in self.fields]
+        if len(set(len(values) for values in saved)) != 1:
+            raise ValueError('Ring fields differ in size')
+        for values in sorted(zip(*saved)):
+            start, count = values[0], values[1]
+            index = int(start // self.bucket_seconds) % self.slots
+            if count and start >= self.start[index]:
+                for [field, value] in zip(self.fields, values):
+                    getattr(self, field)[index] = value
+
+# Rolling hourly and daily aggregates of the readings of one sensor, one ring per parameter and window
+class RollingAggregates:
+    # bucket length in seconds and number of buckets per window
+    windows = OrderedDict([('hour', (300, 12)), ('day', (3600, 24))])
+    # photosynthetic photon flux density in µmol/m²/s per lux of sunlight
+    ppfd_per_lux = 0.0185
+
+    def __init__(self, params):
+        self.params = params
+        self.rings = OrderedDict((param, OrderedDict((window, AggregateRing(*size)) for [window, size] in self.windows.items()))
+                                 for param in params)
+        # previous sample per parameter, for the time integral
+        self.last_time = array('d', [0.0] * len(params))
+        self.last_value = array('d', [0.0] * len(params))
+
+    # Add a reading, samples further apart than max_gap seconds are not integrated over
+    def add(self, timestamp, data, max_gap):
+        for [index, param] in enumerate(self.params):
+            value = data.get(param)
+            # RoPot sensors report no light
+            if value is None or isinstance(value, bool):
+                continue
+            integral = 0.0
+            elapsed = timestamp - self.last_time[index]
+            if 0 < elapsed <= max_gap:
+                # trapezoidal rule
+                integral = (self.last_value[index] + value) / 2 * elapsed
+            self.last_time[index], self.last_value[index] = timestamp, value
+            for ring in self.rings[param].values():
+                ring.add(timestamp, value, integral)
+
+    def summary(self, window, now):
+        summary = OrderedDict([('timestamp', strftime('%Y-%m-%d %H:%M:%S', localtime(now)))])
+        for param in self.params:
+            aggregate = self.rings[param][window].aggregate(now)
+            if aggregate is None:
+                continue
+            integral = aggregate.pop('integral')
+            if param != MI_TEMPERATURE:
+                aggregate['min'], aggregate['max'] = int(aggregate['min']), int(aggregate['max'])
+            if param == MI_LIGHT:
+                # light in mol/m² over the window, the daily light integral (DLI) for the day
+                aggregate['integral'] = round(integral * self.ppfd_per_lux / 1e6, 3)
+            summary[param] = aggregate
+        return summary
+
+    def state(self):
+        return OrderedDict([
+            ('rings', OrderedDict((param, OrderedDict((window, ring.state()) for [window, ring] in rings.items()))
+                                  for [param, rings] in self.rings.items())),
+            ('last', OrderedDict((param, [self.last_time[index], self.last_value[index]]) for [index, param] in enumerate(self.params))),
+        ])
+
+    # Restore a saved state, parameters aggregated only now start empty
+    def load(self, state):
+        for [index, param] in enumerate(self.params):
+            if param not in state['rings']:
+                continue
+            for [window, ring] in self.rings[param].items():
+                ring.load(state['rings'][param][window])
+            self.last_time[index], self.last_value[index] = state['last'][param]
+
+# Reporter plugins, one per reporting method, several of them can serve the same readings
+# The topics of a sensor are computed once in register(), the hooks only fill in the values
+class Reporter:
+    default_base_topic = 'miflora'
+    # publishes over the shared MQTT connection
+    mqtt = True
+    # every parameter is a message of its own, with deadbands only the changed ones are published
+    per_parameter = False
+    # messages carry the time of the reading, so journalled readings can be published
+    timestamped = False
+    # the entries of the sensor history log can be published, consumers do not take them for the current state
+    backfill = False
+    # readings are collected and only published by flush() at the end of the cycle
+    batched = False
+
+    def __init__(self, base_topic=None):
+        self.base_topic = self.default_base_topic if base_topic is None else base_topic
+        self.topics = dict()
+        # retained discovery messages as held by the broker, unchanged ones are not published again
+        self.retained = dict()
+
+    # Last will (topic, payload, qos) of the connection, only one reporter can have it
+    def will(self):
+        return None
+
+    def register(self, flora_name, flora):
+        pass
+
+    def unregister(self, flora_name):
+        self.topics.pop(flora_name, None)
+
+    def on_connect(self, client):
+        pass
+
+    def announce(self, flora_names):
+        pass
+
+    # Topic filters of the retained discovery messages, read from the broker at startup
+    def discovery_filters(self):
+        return []
+
+    # Identifier of a sensor in the discovery messages
+    def device_id(self, flora_name):
+        return flora_name.lower()
+
+    # Sensors found in the retained discovery messages but no longer configured
+    def removed_sensors(self):
+        return []
+
+    # Clear the retained messages of sensors no longer configured
+    def retract(self, flora_names):
+        pass
+
+    def publish_health(self, flora_name, flora):
+        pass
+
+    # Signal strength of a sensor as found by the presence scan, a diagnostic value next to the readings
+    def publish_rssi(self, flora_name, flora):
+        pass
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        pass
+
+    # Publish a retained discovery message unless the broker holds it already, returns whether it was sent
+    def publish_retained(self, topic, payload, qos=1, force=False):
+        # encoded like paho does, to compare with the received payloads
+        payload = payload if isinstance(payload, bytes) else str(payload).encode('utf-8')
+        # an empty retained message is no retained message
+        if not force and self.retained.get(topic, b'') == payload:
+            return False
+        self.retained[topic] = payload
+        mqtt_client.publish(topic, payload, qos, True)
+        return True
+
+    def clear_retained(self, topic):
+        self.retained.pop(topic, None)
+        mqtt_client.publish(topic, b'', 1, True)
+
+    # Publish the collected readings, returns them as (flora_name, timestamp, data) for the journal
+    def flush(self):
+        return []
+
+    def shutdown(self):
+        pass
+
+class MqttJsonReporter(Reporter):
+    timestamped = True
+    backfill = True
+
+    def will(self):
+        return ('{}/$announce'.format(self.base_topic), '{}', 0)
+
+    def register(self, flora_name, flora):
+        self.topics[flora_name] = '{}/{}'.format(self.base_topic, flora_name)
+
+    def announce(self, flora_names):
+        print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
+        # one message announcing all sensors
+        flores_info = dict()
+        for [flora_name, flora] in flores.items():
+            flora_info = {key: flora[key] for key in ['name_pretty', 'mac', 'refresh', 'adapter', 'location_clean', 'location_pretty', 'firmware']}
+            flora_info['topic'] = self.topics[flora_name]
+            flores_info[flora_name] = flora_info
+        self.publish_retained('{}/$announce'.format(self.base_topic), json.dumps(flores_info), 0)
+
+    def discovery_filters(self):
+        return ['{}/$announce'.format(self.base_topic)]
+
+    def retract(self, flora_names):
+        # announced again without them
+        self.announce([])
+
+    def publish_rssi(self, flora_name, flora):
+        mqtt_client.publish('{}/rssi'.format(self.topics[flora_name]), json.dumps({'rssi': flora['rssi'], 'adapter': flora['rssi_adapter']}), reading_qos)
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        print_line('Publishing to MQTT topic "{}"'.format(self.topics[flora_name]))
+        if replayed:
+            data['timestamp'] = strftime('%Y-%m-%d %H:%M:%S', localtime(timestamp))
+        mqtt_client.publish(self.topics[flora_name], json.dumps(data), reading_qos)
+
+class HomieReporter(Reporter):
+    default_base_topic = 'homie'
+    per_parameter = True
+
+    def __init__(self, base_topic=None):
+        super().__init__(base_topic)
+        self.bridge_path = '{}/{}'.format(self.base_topic, homie_bridge_id)
+        self.bridge_announced = False
+
+    def will(self):
+        # one connection serves all devices, its last will goes to the bridge device
+        return ('{}/$state'.format(self.bridge_path), 'lost', 1)
+
+    def register(self, flora_name, flora):
+        topic_path = '{}/{}'.format(self.base_topic, flora_name.lower())
+        self.topics[flora_name] = {
+            'path': topic_path,
+            'state': '{}/$state'.format(topic_path),
+            'timestamp': '{}/$stats/timestamp'.format(topic_path),
+            'parameters': {param: '{}/sensor/{}'.format(topic_path, param) for param in parameters},
+        }
+
+    def on_connect(self, client):
+        # the last will of the shared connection marks the bridge lost, revive it
+        client.publish('{}/$state'.format(self.bridge_path), 'ready', 1, True)
+
+    # Attributes of the bridge device carrying the last will of the shared connection
+    def bridge_attributes(self):
+        attributes = [
+            ('{}/$homie'.format(self.bridge_path), homie_version),
+            ('{}/$name'.format(self.bridge_path), project_name),
+            ('{}/$nodes'.format(self.bridge_path), ''),
+        ]
+        if homie_version == '4.0':
+            attributes.append(('{}/$extensions'.format(self.bridge_path), ''))
+        attributes.append(('{}/$state'.format(self.bridge_path), 'ready'))
+        return attributes
+
+    # Attributes of one Mi Flora device, generated from the parameters table
+    def device_attributes(self, flora_name, flora):
+        topics = self.topics[flora_name]
+        topic_path = topics['path']
+        attributes = [
+            (topics['state'], 'init'),
+            ('{}/$homie'.format(topic_path), homie_version),
+            ('{}/$name'.format(topic_path), flora['name_pretty']),
+        ]
+        if homie_version == '4.0':
+            # $mac, $fw and $stats moved to the legacy extensions in Homie 4
+            attributes.append(('{}/$extensions'.format(topic_path), 'org.homie.legacy-stats:0.1.1:[4.x],org.homie.legacy-firmware:0.1.1:[4.x]'))
+        attributes += [
+            ('{}/$mac'.format(topic_path), flora['mac']),
+            ('{}/$stats'.format(topic_path), 'interval,timestamp'),
+            ('{}/$stats/interval'.format(topic_path), flora['refresh']),
+            (topics['timestamp'], strftime('%Y-%m-%dT%H:%M:%S%z', localtime())),
+            ('{}/$fw/name'.format(topic_path), 'miflora-firmware'),
+            ('{}/$fw/version'.format(topic_path), flora['firmware']),
+            ('{}/$nodes'.format(topic_path), 'sensor'),
+        ]
+
+        sensor_path = '{}/sensor'.format(topic_path)
+        attributes.append(('{}/$name'.format(sensor_path), 'miflora'))
+        if homie_version == '4.0':
+            attributes.append(('{}/$type'.format(sensor_path), 'miflora'))
+        attributes.append(('{}/$properties'.format(sensor_path), ','.join(sorted(parameters))))
+        for param in sorted(parameters):
+            params = parameters[param]
+            attributes += [
+                ('{}/{}/$name'.format(sensor_path, param), param),
+                ('{}/{}/$settable'.format(sensor_path, param), 'false'),
+                ('{}/{}/$unit'.format(sensor_path, param), params['unit']),
+                ('{}/{}/$datatype'.format(sensor_path, param), 'integer' if params['typeformat'] == '%d' else 'float'),
+                ('{}/{}/$format'.format(sensor_path, param), params['homie_format']),
+                ('{}/{}/$retained'.format(sensor_path, param), 'true'),
+            ]
+        attributes.append((topics['state'], homie_health_states[flora['stats']['health']]))
+        return attributes
+
+    def announce(self, flora_names):
+        print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
+        published = total = 0
+        if not self.bridge_announced:
+            for [topic, payload] in self.bridge_attributes():
+                published += self.publish_retained(topic, payload)
+                total += 1
+            self.bridge_announced = True
+        # pipelined, only bounded by the in-flight window of the client
+        for flora_name in flora_names:
+            topics = self.topics[flora_name]
+            attributes = self.device_attributes(flora_name, flores[flora_name])
+            total += len(attributes)
+            # $state and the timestamp differ on every announcement, the device changed if anything else differs
+            changed = any(self.retained.get(topic, b'') != str(payload).encode('utf-8')
+                          for [topic, payload] in attributes if topic not in [topics['state'], topics['timestamp']])
+            if changed:
+                for [topic, payload] in attributes:
+                    self.publish_retained(topic, payload, force=True)
+                published += len(attributes)
+            else:
+                published += self.publish_retained(*attributes[-1])
+        print_line('Published {} of {} Homie {} attributes for {} device(s)'.format(published, total, homie_version, len(flora_names)))
+
+    def discovery_filters(self):
+        return ['{}/#'.format(self.base_topic)]
+
+    def removed_sensors(self):
+        devices = set()
+        for [topic, payload] in self.retained.items():
+            levels = topic[len(self.base_topic) + 1:].split('/')
+            if topic.startswith(self.base_topic + '/') and levels[1:] == ['$fw', 'name'] and payload == b'miflora-firmware':
+                devices.add(levels[0])
+        return sorted(devices - {self.device_id(flora_name) for flora_name in flores})
+
+    def retract(self, flora_names):
+        for flora_name in flora_names:
+            topic_path = '{}/{}'.format(self.base_topic, flora_name.lower())
+            topics = set(topic for topic in self.retained if topic.startswith(topic_path + '/'))
+            topics.update('{}/sensor/{}'.format(topic_path, param) for param in parameters)
+            # the device $state last, removing the device
+            for topic in sorted(topics, key=lambda topic: topic == '{}/$state'.format(topic_path)):
+                self.clear_retained(topic)
+
+    def publish_health(self, flora_name, flora):
+        mqtt_client.publish(self.topics[flora_name]['state'], homie_health_states[flora['stats']['health']], 1, True)
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        topics = self.topics[flora_name]
+        print_line('Publishing data to MQTT base topic "{}"'.format(topics['path']))
+        mqtt_client.publish(topics['state'], 'ready', 1, True)
+        for [param, value] in data.items():
+            mqtt_client.publish(topics['parameters'][param], value, 1, True)
+        mqtt_client.publish(topics['timestamp'], strftime('%Y-%m-%dT%H:%M:%S%z', localtime(timestamp)), 1, True)
+
+    def shutdown(self):
+        for flora_name in flores:
+            mqtt_client.publish(self.topics[flora_name]['state'], 'disconnected', 1, True)
+        mqtt_client.publish('{}/$state'.format(self.bridge_path), 'disconnected', 1, True)
+
+class MqttSmarthomeReporter(Reporter):
+    per_parameter = True
+    timestamped = True
+    backfill = True
+
+    def will(self):
+        return ('{}/connected'.format(self.base_topic), '0', 0)
+
+    def register(self, flora_name, flora):
+        self.topics[flora_name] = {param: '{}/status/{}/{}'.format(self.base_topic, flora_name, param) for param in list(parameters) + ['rssi']}
+
+    def on_connect(self, client):
+        client.publish('{}/connected'.format(self.base_topic), payload='1', retain=True)
+
+    def publish_rssi(self, flora_name, flora):
+        payload = {'val': flora['rssi'], 'ts': int(round(flora['seen'] * 1000))}
+        mqtt_client.publish(self.topics[flora_name]['rssi'], json.dumps(payload), 1, True)
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        for [param, value] in data.items():
+            print_line('Publishing data to MQTT topic "{}"'.format(self.topics[flora_name][param]))
+            payload = dict()
+            payload['val'] = value
+            payload['ts'] = int(round(timestamp * 1000))
+            mqtt_client.publish(self.topics[flora_name][param], json.dumps(payload), reading_qos, True)
+
+    def shutdown(self):
+        mqtt_client.publish('{}/connected'.format(self.base_topic), payload='0', retain=True)
+
+class HomeAssistantReporter(Reporter):
+    default_base_topic = 'homeassistant'
+    timestamped = True
+    model = 'MiFlora Plant Sensor (HHCCJCY01)'
+
+    def register(self, flora_name, flora):
+        state_topic = '{}/sensor/{}/state'.format(self.base_topic, flora_name.lower())
+        availability_topic = '{}/sensor/{}/availability'.format(self.base_topic, flora_name.lower())
+        device = {
+                'identifiers' : ["MiFlora{}".format(flora['mac'].lower().replace(":", ""))],
+                'connections' : [["mac", flora['mac'].lower()]],
+                'manufacturer' : 'Xiaomi',
+                'name' : flora_name,
+                'model' : self.model,
+                'sw_version': flora['firmware']
+        }
+        discovery = []
+        for [sensor, params] in parameters.items():
+            discovery_topic = 'homeassistant/sensor/{}/{}/config'.format(flora_name.lower(), sensor)
+            payload = OrderedDict()
+            payload['name'] = "{} {}".format(flora_name, sensor.title())
+            payload['unique_id'] = "{}-{}".format(flora['mac'].lower().replace(":", ""), sensor)
+            payload['unit_of_measurement'] = params['unit']
+            if 'device_class' in params:
+                payload['device_class'] = params['device_class']
+            if 'state_class' in params:
+                payload['state_class'] = params['state_class']
+            payload['state_topic'] = state_topic
+            payload['availability_topic'] = availability_topic
+            if journal is not None:
+                # the state carries the timestamp of the reading, replayed readings can be told apart
+                payload['json_attributes_topic'] = state_topic
+                payload['json_attributes_template'] = "{{ {'timestamp': value_json.timestamp} | tojson }}"
+            payload['value_template'] = "{{{{ value_json.{} }}}}".format(sensor)
+            # shared by the parameters of the sensor, the firmware version is filled in when announcing
+            payload['device'] = device
+            if params.get('deadband') is None:
+                payload['expire_after'] = str(int(flora['refresh'] * 1.5))
+            elif heartbeat:
+                # unchanged values are only repeated with the heartbeat
+                payload['expire_after'] = str(int(max(flora['refresh'], heartbeat) * 1.5))
+            discovery.append((discovery_topic, payload))
+        rssi_topic = '{}/sensor/{}/rssi'.format(self.base_topic, flora_name.lower())
+        if presence_scan:
+            payload = OrderedDict()
+            payload['name'] = "{} RSSI".format(flora_name)
+            payload['unique_id'] = "{}-rssi".format(flora['mac'].lower().replace(":", ""))
+            payload['unit_of_measurement'] = 'dBm'
+            payload['device_class'] = 'signal_strength'
+            payload['state_class'] = 'measurement'
+            payload['entity_category'] = 'diagnostic'
+            payload['state_topic'] = rssi_topic
+            payload['availability_topic'] = availability_topic
+            payload['device'] = device
+            discovery.append(('homeassistant/sensor/{}/rssi/config'.format(flora_name.lower()), payload))
+        self.topics[flora_name] = {'state': state_topic, 'availability': availability_topic, 'rssi': rssi_topic, 'device': device, 'discovery': discovery}
+
+    def announce(self, flora_names):
+        print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
+        published = total = 0
+        for flora_name in flora_names:
+            flora = flores[flora_name]
+            topics = self.topics[flora_name]
+            topics['device']['sw_version'] = flora['firmware']
+            for [discovery_topic, payload] in topics['discovery']:
+                published += self.publish_retained(discovery_topic, json.dumps(payload))
+                total += 1
+            self.publish_health(flora_name, flora)
+        print_line('Published {} of {} discovery messages for {} device(s)'.format(published, total, len(flora_names)))
+
+    def discovery_filters(self):
+        return ['homeassistant/sensor/+/+/config']
+
+    def removed_sensors(self):
+        nodes = set()
+        for [topic, payload] in self.retained.items():
+            try:
+                device = json.loads(payload.decode('utf-8')).get('device', dict())
+            except (ValueError, AttributeError):
+                continue
+            if device.get('model') == self.model:
+                nodes.add(topic.split('/')[2])
+        return sorted(nodes - {self.device_id(flora_name) for flora_name in flores})
+
+    def retract(self, flora_names):
+        for flora_name in flora_names:
+            node = flora_name.lower()
+            topics = set(topic for topic in self.retained if topic.split('/')[2] == node)
+            diagnostics = ['rssi'] if presence_scan else []
+            topics.update('homeassistant/sensor/{}/{}/config'.format(node, sensor) for sensor in list(parameters) + diagnostics)
+            for topic in sorted(topics):
+                self.clear_retained(topic)
+            for state in ['state', 'availability'] + diagnostics:
+                self.clear_retained('{}/sensor/{}/{}'.format(self.base_topic, node, state))
+
+    def publish_health(self, flora_name, flora):
+        availability = 'offline' if flora['stats']['health'] == 'open' else 'online'
+        mqtt_client.publish(self.topics[flora_name]['availability'], availability, 1, True)
+
+    def publish_rssi(self, flora_name, flora):
+        mqtt_client.publish(self.topics[flora_name]['rssi'], flora['rssi'], 1, True)
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        print_line('Publishing to MQTT topic "{}"'.format(self.topics[flora_name]['state']))
+        if journal is not None:
+            # exposed as attribute, tells replayed readings apart
+            data['timestamp'] = strftime('%Y-%m-%dT%H:%M:%S%z', localtime(timestamp))
+        mqtt_client.publish(self.topics[flora_name]['state'], json.dumps(data), reading_qos, True)
+
+class GladysReporter(Reporter):
+    default_base_topic = 'gladys/master/device'
+    per_parameter = True
+
+    def register(self, flora_name, flora):
+        topic_path = '{}/mqtt:miflora:{}/feature'.format(self.base_topic, flora_name.lower())
+        self.topics[flora_name] = {param: '{}/mqtt:{}/state'.format(topic_path, param) for param in parameters}
+
+    def announce(self, flora_names):
+        print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
+        for flora_name in flora_names:
+            if flores[flora_name]['reading'] is not None:
+                # the last known good values until the first measurement
+                self.publish(flora_name, flores[flora_name], flores[flora_name]['reading'], time())
+
+    def retract(self, flora_names):
+        for flora_name in flora_names:
+            for topic in self.topics[flora_name].values():
+                self.clear_retained(topic)
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        for [param, value] in data.items():
+            print_line('Publishing data to MQTT topic "{}"'.format(self.topics[flora_name][param]))
+            mqtt_client.publish(self.topics[flora_name][param], value, 1, True)
+
+class ThingsboardReporter(Reporter):
+    default_base_topic = 'v1/devices/me/telemetry'
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        print_line('Publishing to MQTT topic "{}" username "{}"'.format(self.base_topic, flora_name))
+        mqtt_client.username_pw_set(flora_name)
+        mqtt_client.connection_established.clear()
+        mqtt_client.reconnect()
+        mqtt_client.wait_for_connection()
+        mqtt_client.publish(self.base_topic, json.dumps(data))
+        mqtt_client.wait_for_acks()
+
+class ThingsboardGatewayReporter(Reporter):
+    default_base_topic = 'v1/gateway'
+    timestamped = True
+    backfill = True
+    batched = True
+
+    def __init__(self, base_topic=None):
+        super().__init__(base_topic)
+        self.telemetry_batch = OrderedDict()
+
+    def announce(self, flora_names):
+        print_line('Announcing Mi Flora devices to the ThingsBoard gateway ...')
+        attributes = OrderedDict()
+        for flora_name in flora_names:
+            flora = flores[flora_name]
+            mqtt_client.publish('{}/connect'.format(self.base_topic), json.dumps({'device': flora_name, 'type': 'miflora'}), 1)
+            attributes[flora_name] = {'mac': flora['mac'], 'firmware': flora['firmware'], 'location': flora['location_pretty']}
+        mqtt_client.publish('{}/attributes'.format(self.base_topic), json.dumps(attributes), 1)
+
+    def retract(self, flora_names):
+        for flora_name in flora_names:
+            mqtt_client.publish('{}/disconnect'.format(self.base_topic), json.dumps({'device': flora_name}), 1)
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        # sent as one message for all devices by flush()
+        self.telemetry_batch.setdefault(flora_name, []).append({'ts': int(round(timestamp * 1000)), 'values': data})
+
+    def flush(self):
+        if not self.telemetry_batch:
+            return []
+        print_line('Publishing telemetry of {} device(s) to MQTT topic "{}/telemetry"'.format(len(self.telemetry_batch), self.base_topic))
+        mqtt_client.publish('{}/telemetry'.format(self.base_topic), json.dumps(self.telemetry_batch), 1)
+        readings = [(flora_name, reading['ts'] / 1000.0, reading['values'])
+                    for [flora_name, telemetry] in self.telemetry_batch.items() for reading in telemetry]
+        self.telemetry_batch.clear()
+        return readings
+
+    def shutdown(self):
+        for flora_name in flores:
+            mqtt_client.publish('{}/disconnect'.format(self.base_topic), json.dumps({'device': flora_name}), 1)
+
+class WirenboardReporter(Reporter):
+    default_base_topic = ''
+    per_parameter = True
+
+    def register(self, flora_name, flora):
+        topic_path = '/devices/{}/controls'.format(flora_name)
+        self.topics[flora_name] = {param: '{}/{}'.format(topic_path, param) for param in list(parameters) + ['timestamp']}
+
+    def announce(self, flora_names):
+        print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
+        for flora_name in flora_names:
+            self.publish_retained('/devices/{}/meta/name'.format(flora_name), flora_name)
+            topic_path = '/devices/{}/controls'.format(flora_name)
+            self.publish_retained('{}/battery/meta/type'.format(topic_path), 'value')
+            self.publish_retained('{}/battery/meta/units'.format(topic_path), '%')
+            self.publish_retained('{}/conductivity/meta/type'.format(topic_path), 'value')
+            self.publish_retained('{}/conductivity/meta/units'.format(topic_path), 'µS/cm')
+            self.publish_retained('{}/light/meta/type'.format(topic_path), 'value')
+            self.publish_retained('{}/light/meta/units'.format(topic_path), 'lux')
+            self.publish_retained('{}/moisture/meta/type'.format(topic_path), 'rel_humidity')
+            self.publish_retained('{}/temperature/meta/type'.format(topic_path), 'temperature')
+            self.publish_retained('{}/timestamp/meta/type'.format(topic_path), 'text')
+
+    def discovery_filters(self):
+        return ['/devices/+/meta/name', '/devices/+/controls/+/meta/+']
+
+    def device_id(self, flora_name):
+        return flora_name
+
+    def removed_sensors(self):
+        devices = set(topic.split('/')[2] for topic in self.retained)
+        # the devices of the controller carrying the controls of a Mi Flora sensor
+        devices = [device for device in devices
+                   if self.retained.get('/devices/{}/controls/conductivity/meta/units'.format(device)) == 'µS/cm'.encode('utf-8')
+                   and self.retained.get('/devices/{}/controls/moisture/meta/type'.format(device)) == b'rel_humidity']
+        return sorted(set(devices) - {self.device_id(flora_name) for flora_name in flores})
+
+    def retract(self, flora_names):
+        for flora_name in flora_names:
+            topic_path = '/devices/{}/'.format(flora_name)
+            topics = set(topic for topic in self.retained if topic.startswith(topic_path))
+            topics.update('{}controls/{}'.format(topic_path, control) for control in list(parameters) + ['timestamp'])
+            for topic in sorted(topics):
+                self.clear_retained(topic)
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        topics = self.topics[flora_name]
+        for [param, value] in data.items():
+            print_line('Publishing data to MQTT topic "{}"'.format(topics[param]))
+            mqtt_client.publish(topics[param], value, retain=True)
+        mqtt_client.publish(topics['timestamp'], strftime('%Y-%m-%d %H:%M:%S', localtime(timestamp)), retain=True)
+
+class JsonReporter(Reporter):
+    mqtt = False
+    timestamped = True
+    backfill = True
+
+    def publish(self, flora_name, flora, data, timestamp, replayed=False):
+        data['timestamp'] = strftime('%Y-%m-%d %H:%M:%S', localtime(timestamp))
+        data['name'] = flora_name
+        data['name_pretty'] = flora['name_pretty']
+        data['mac'] = flora['mac']
+        data['firmware'] = flora['firmware']
+        print('Data for "{}": {}'.format(flora_name, json.dumps(data)))
+
+reporter_classes = OrderedDict([
+    ('mqtt-json', MqttJsonReporter),
+    ('mqtt-homie', HomieReporter),
+    ('json', JsonReporter),
+    ('mqtt-smarthome', MqttSmarthomeReporter),
+    ('homeassistant-mqtt', HomeAssistantReporter),
+    ('gladys-mqtt', GladysReporter),
+    ('thingsboard-json', ThingsboardReporter),
+    ('thingsboard-gateway', ThingsboardGatewayReporter),
+    ('wirenboard-mqtt', WirenboardReporter),
+])
+
+# Homie device $state per sensor health
+homie_health_states = {'healthy': 'ready', 'degraded': 'alert', 'open': 'lost'}
+
 # Eclipse Paho callbacks - http://www.eclipse.org/paho/clients/python/docs/#callbacks
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
+        client.connection_established.set()
+        for reporter in mqtt_reporters:
+            reporter.on_connect(client)
         print_line('MQTT connection established', console=True, sd_notify=True)
         print()
     else:
-        print_line('Connection error with result code {} - {}'.format(str(rc), mqtt.connack_string(rc)), error=True)
-        #kill main thread
-        os._exit(1)
+        # keep running, paho retries in the background and readings go to the journal meanwhile
+        print_line('Connection error with result code {} - {}'.format(str(rc), mqtt.connack_string(rc)), error=True, sd_notify=True)
+
+
+def on_disconnect(client, userdata, rc):
+    client.connection_established.clear()
+    if rc != 0:
+        print_line('MQTT connection lost, reconnecting ...', warning=True, sd_notify=True)
 
 
 def on_publish(client, userdata, mid):
-    #print_line('Data successfully published.')
-    pass
+    client.acknowledge(mid)
+
+
+def on_subscribe(client, userdata, mid, granted_qos):
+    client.subscribed()
+
+
+def on_message(client, userdata, message):
+    client.receive(message)
+
+# Settings of the [Daemon] section which take effect without a restart, applied again on reload
+def apply_daemon_settings(daemon_config):
+    global sleep_period, jitter, overrun_policy, heartbeat, breaker_threshold, breaker_max_backoff, history_interval, history_max_entries
+    global journal_batch_size, journal_interval, passive_timeout, passive_battery_timeout
+    # all validated before any of them changes
+    period = daemon_config.getint('period', 300)
+    if period < 1:
+        raise ValueError('Configuration parameter period must be at least 1 second')
+    overrun = daemon_config.get('overrun', 'skip')
+    if overrun not in ['skip', 'catch_up', 'reset']:
+        raise ValueError('Configuration parameter overrun set to an invalid value')
+    deadbands = dict()
+    for deadband_entry in [entry.strip() for entry in daemon_config.get('deadband', '').split(',') if entry.strip()]:
+        param, _, deadband = deadband_entry.partition(':')
+        try:
+            if param.strip() not in parameters:
+                raise ValueError(param)
+            deadbands[param.strip()] = float(deadband)
+        except ValueError:
+            raise ValueError('Configuration parameter deadband must be a comma separated list like "temperature:0.2, moisture:1"')
+    settings = [
+        daemon_config.getint('jitter', 0),
+        daemon_config.getint('heartbeat', 0),
+        daemon_config.getint('breaker_threshold', 3),
+        daemon_config.getint('breaker_max_backoff', 3600),
+        daemon_config.getint('history_interval', 3600),
+        daemon_config.getint('history_max_entries', 200),
+        daemon_config.getint('journal_batch_size', 50),
+        daemon_config.getfloat('journal_interval', 1.0),
+        daemon_config.getint('passive_timeout', 2 * period),
+        daemon_config.getint('passive_battery_timeout', 24 * 3600),
+    ]
+    sleep_period, overrun_policy = period, overrun
+    jitter, heartbeat, breaker_threshold, breaker_max_backoff, history_interval, history_max_entries, \
+        journal_batch_size, journal_interval, passive_timeout, passive_battery_timeout = settings
+    for [param, params] in parameters.items():
+        if param in deadbands:
+            params['deadband'] = deadbands[param]
+        else:
+            params.pop('deadband', None)
+
+# Options taking effect on reload, changes of the others need a restart
+reloadable_options = {
+    'General': [],
+    'Daemon': ['period', 'jitter', 'overrun', 'deadband', 'heartbeat', 'breaker_threshold', 'breaker_max_backoff', 'history_interval',
+               'history_max_entries', 'journal_batch_size', 'journal_interval', 'passive_timeout', 'passive_battery_timeout'],
+    'MQTT': ['hostname', 'port', 'keepalive', 'username', 'password', 'tls', 'tls_ca_cert', 'tls_keyfile', 'tls_certfile',
+             'max_inflight', 'ack_timeout', 'discovery_sync', 'metrics_topic'],
+}
+
+# Broker address and credentials, a change needs a new connection
+def mqtt_broker_settings(mqtt_config):
+    return (os.environ.get('MQTT_HOSTNAME', mqtt_config.get('hostname', 'localhost')),
+            int(os.environ.get('MQTT_PORT', mqtt_config.get('port', '1883'))),
+            mqtt_config.getint('keepalive', 60),
+            os.environ.get("MQTT_USERNAME", mqtt_config.get('username')),
+            os.environ.get("MQTT_PASSWORD", mqtt_config.get('password', None)),
+            mqtt_config.getboolean('tls', False),
+            mqtt_config.get('tls_ca_cert', None),
+            mqtt_config.get('tls_keyfile', None),
+            mqtt_config.get('tls_certfile', None))
+
+# Connect to the MQTT broker, returns None if the settings are unusable
+def connect_mqtt(mqtt_config):
+    print_line('Connecting to MQTT broker ...')
+    hostname, port, keepalive, username, password, tls, tls_ca_cert, tls_keyfile, tls_certfile = mqtt_broker_settings(mqtt_config)
+    client_class = SimulatedMqttClient if mqtt_simulation else AckTrackingClient
+    client = client_class(max_inflight=mqtt_config.getint('max_inflight', 20), ack_timeout=mqtt_config.getfloat('ack_timeout', 5.0))
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_publish = on_publish
+    client.on_subscribe = on_subscribe
+    client.on_message = on_message
+    # a connection has a single last will, the one of the first reporter having one
+    wills = [reporter.will() for reporter in mqtt_reporters if reporter.will() is not None]
+    if wills:
+        will_topic, will_payload, will_qos = wills[0]
+        client.will_set(will_topic, payload=will_payload, qos=will_qos, retain=True)
+    if len(wills) > 1:
+        print_line('Only the last will on "{}" is set, the MQTT connection can carry one'.format(wills[0][0]), warning=True)
+
+    if username:
+        client.username_pw_set(username, password)
+    try:
+        if tls:
+            # According to the docs, setting PROTOCOL_SSLv23 "Selects the highest protocol version
+            # that both the client and server support. Despite the name, this option can select
+            # “TLS” protocols as well as “SSL”" - so this seems like a resonable default
+            client.tls_set(
+                ca_certs=tls_ca_cert,
+                keyfile=tls_keyfile,
+                certfile=tls_certfile,
+                tls_version=ssl.PROTOCOL_SSLv23
+            )
+        connect = client.connect if 'thingsboard-json' in reporting_modes else client.connect_async
+        connect(hostname, port=port, keepalive=keepalive)
+    except:
+        print_line('MQTT connection error. Please check your settings in the configuration file "config.ini"', error=True, sd_notify=True)
+        return None
+    if 'thingsboard-json' not in reporting_modes:
+        # connects in the background and keeps retrying while the broker is unreachable
+        client.loop_start()
+    else:
+        client.manual_loop = True
+    if not client.wait_for_connection():
+        print_line('No MQTT connection within {} seconds, retrying in the background'.format(client.ack_timeout), warning=True, sd_notify=True)
+    return client
 
 # Load configuration file
 config_dir = parse_args.config_dir
+# the state files are written while running, the configuration directory may be read-only
+state_dir = parse_args.state_dir or os.environ.get('STATE_DIRECTORY', '').split(':')[0] or config_dir
 
 config = ConfigParser(delimiters=('=', ), inline_comment_prefixes=('#'))
 config.optionxform = str
@@ -99,88 +1713,208 @@ except IOError:
     print_line('No configuration file "config.ini"', error=True, sd_notify=True)
     sys.exit(1)
 
-reporting_mode = config['General'].get('reporting_method', 'mqtt-json')
+reporting_modes = [mode.strip() for mode in config['General'].get('reporting_method', 'mqtt-json').split(',') if mode.strip()]
 used_adapter = config['General'].get('adapter', 'hci0')
+used_adapters = [adapter.strip() for adapter in config['General'].get('adapters', used_adapter).split(',') if adapter.strip()]
+adapter_concurrency = config['General'].getint('adapter_concurrency', 1)
+ble_backends = {'bluepy': BluepyBackend, 'gatttool': GatttoolBackend, 'simulation': SimulatedBackend}
+ble_backend = config['General'].get('backend', 'bluepy')
 daemon_enabled = config['Daemon'].getboolean('enabled', True)
+daemon_mode = config['Daemon'].get('mode', 'active')
 
-if reporting_mode == 'mqtt-homie':
-    default_base_topic = 'homie'
-elif reporting_mode == 'homeassistant-mqtt':
-    default_base_topic = 'homeassistant'
-elif reporting_mode == 'thingsboard-json':
-    default_base_topic = 'v1/devices/me/telemetry'
-elif reporting_mode == 'wirenboard-mqtt':
-    default_base_topic = ''
-else:
-    default_base_topic = 'miflora'
-
-base_topic = config['MQTT'].get('base_topic', default_base_topic).lower()
-sleep_period = config['Daemon'].getint('period', 300)
-miflora_cache_timeout = sleep_period - 1
+# without a base_topic every reporter uses its own default
+base_topic = config['MQTT'].get('base_topic')
+if base_topic is not None:
+    base_topic = base_topic.lower()
+discovery_sync = config['MQTT'].getfloat('discovery_sync', 0.5)
+homie_version = config['MQTT'].get('homie_version', '3.0')
+mqtt_simulation = config['MQTT'].getboolean('simulation', False)
+journal_path = config['Daemon'].get('journal', '')
+journal_size = config['Daemon'].getint('journal_size', 1048576)
+history_enabled = config['Daemon'].getboolean('history', False)
+history_cursors_path = config['Daemon'].get('history_cursors', 'history_cursors.json')
+device_cache_path = config['Daemon'].get('device_cache', 'device_cache.json')
+device_cache_interval = config['Daemon'].getint('device_cache_interval', 3600)
+announced_sensors_path = config['Daemon'].get('announced_sensors', 'announced_sensors.json')
+metrics_port = config['Daemon'].getint('metrics_port', 0)
+metrics_address = config['Daemon'].get('metrics_address', '127.0.0.1')
+metrics_topic = config['MQTT'].get('metrics_topic', '')
+presence_scan = config['Daemon'].getfloat('presence_scan', 0)
+aggregate_params = [param.strip() for param in config['Daemon'].get('aggregates', '').split(',') if param.strip()]
+aggregate_interval = config['Daemon'].getint('aggregate_interval', 900)
+aggregates_path = config['Daemon'].get('aggregates_file', 'aggregates.json')
+aggregate_topic = config['MQTT'].get('aggregate_topic', '{}/{{sensor}}/aggregates/{{window}}'.format(base_topic or 'miflora'))
+try:
+    apply_daemon_settings(config['Daemon'])
+except ValueError as e:
+    print_line('The [Daemon] section is invalid: {}. Please check your configuration'.format(e), error=True, sd_notify=True)
+    sys.exit(1)
+if ble_backend == 'simulation' or mqtt_simulation:
+    try:
+        SimulatedBackend.connect_latency = config.getfloat('Simulation', 'connect_latency', fallback=1.0)
+        SimulatedBackend.connect_jitter = config.getfloat('Simulation', 'connect_jitter', fallback=0.5)
+        SimulatedBackend.read_latency = config.getfloat('Simulation', 'read_latency', fallback=0.05)
+        SimulatedBackend.failure_rate = config.getfloat('Simulation', 'failure_rate', fallback=0.0)
+        SimulatedBackend.absence_rate = config.getfloat('Simulation', 'absence_rate', fallback=0.0)
+        SimulatedBackend.history_entries = config.getint('Simulation', 'history_entries', fallback=24)
+        for param in parameters:
+            if config.has_option('Simulation', param):
+                low, high = config.get('Simulation', param).split(':')
+                number = float if param == MI_TEMPERATURE else int
+                SimulatedBackend.ranges[param] = (number(low), number(high))
+        InProcessMqttClient.ack_latency = config.getfloat('Simulation', 'broker_latency', fallback=0.005)
+    except ValueError as e:
+        print_line('The [Simulation] section is invalid: {}. Please check your configuration'.format(e), error=True, sd_notify=True)
+        sys.exit(1)
 
 # Check configuration
-if reporting_mode not in ['mqtt-json', 'mqtt-homie', 'json', 'mqtt-smarthome', 'homeassistant-mqtt', 'thingsboard-json', 'wirenboard-mqtt']:
-    print_line('Configuration parameter reporting_mode set to an invalid value', error=True, sd_notify=True)
+if not reporting_modes or not all(mode in reporter_classes for mode in reporting_modes) or len(set(reporting_modes)) != len(reporting_modes):
+    print_line('Configuration parameter reporting_method must be one or a comma separated list of {}'.format(', '.join(reporter_classes)), error=True, sd_notify=True)
+    sys.exit(1)
+if 'thingsboard-json' in reporting_modes and len([mode for mode in reporting_modes if reporter_classes[mode].mqtt]) > 1:
+    print_line('"reporting_method = thingsboard-json" reconnects for every sensor and can not share the MQTT connection', error=True, sd_notify=True)
+    sys.exit(1)
+if daemon_mode not in ['active', 'passive']:
+    print_line('Configuration parameter mode set to an invalid value', error=True, sd_notify=True)
+    sys.exit(1)
+if ble_backend not in ble_backends:
+    print_line('Configuration parameter backend set to an invalid value', error=True, sd_notify=True)
+    sys.exit(1)
+if ble_backend == 'simulation' and daemon_mode == 'passive':
+    print_line('Simulated sensors send no advertisements, "mode = passive" needs a real backend', error=True, sd_notify=True)
+    sys.exit(1)
+if not used_adapters or not all(re.match('hci[0-9]+$', adapter) for adapter in used_adapters):
+    print_line('Configuration parameter adapters must be a comma separated list like "hci0, hci1"', error=True, sd_notify=True)
+    sys.exit(1)
+if adapter_concurrency < 1:
+    print_line('Configuration parameter adapter_concurrency must be at least 1', error=True, sd_notify=True)
+    sys.exit(1)
+if presence_scan < 0:
+    print_line('Configuration parameter presence_scan must not be negative', error=True, sd_notify=True)
     sys.exit(1)
 if not config['Sensors']:
     print_line('No sensors found in configuration file "config.ini"', error=True, sd_notify=True)
     sys.exit(1)
-if reporting_mode == 'wirenboard-mqtt' and base_topic:
+if 'mqtt-homie' in reporting_modes and homie_version not in ['3.0', '4.0']:
+    print_line('Configuration parameter homie_version must be "3.0" or "4.0"', error=True, sd_notify=True)
+    sys.exit(1)
+# the journal replays to every MQTT reporter, the history goes to the ones publishing old readings only
+mqtt_classes = [reporter_classes[mode] for mode in reporting_modes if reporter_classes[mode].mqtt]
+if journal_path and (not mqtt_classes or not all(reporter_class.timestamped for reporter_class in mqtt_classes)):
+    print_line('Parameter "journal" ignored for "reporting_method = {}" without timestamped messages'.format(', '.join(reporting_modes)), warning=True, sd_notify=True)
+    journal_path = ''
+if history_enabled and not any(reporter_classes[mode].backfill for mode in reporting_modes):
+    print_line('Parameter "history" ignored for "reporting_method = {}" without messages for old readings'.format(', '.join(reporting_modes)), warning=True, sd_notify=True)
+    history_enabled = False
+if 'wirenboard-mqtt' in reporting_modes and base_topic:
     print_line('Parameter "base_topic" ignored for "reporting_method = wirenboard-mqtt"', warning=True, sd_notify=True)
+if not all(param in parameters for param in aggregate_params):
+    print_line('Configuration parameter aggregates must be a comma separated list of {}'.format(', '.join(parameters)), error=True, sd_notify=True)
+    sys.exit(1)
+if aggregate_params and (not mqtt_classes or 'thingsboard-json' in reporting_modes):
+    print_line('Parameter "aggregates" ignored for "reporting_method = {}" without a shared MQTT connection'.format(', '.join(reporting_modes)), warning=True, sd_notify=True)
+    aggregate_params = []
+if aggregate_params:
+    try:
+        if aggregate_topic.format(sensor='{sensor}', window='{window}') != aggregate_topic or '{sensor}' not in aggregate_topic or '{window}' not in aggregate_topic:
+            raise ValueError(aggregate_topic)
+    except (KeyError, IndexError, ValueError):
+        print_line('Configuration parameter aggregate_topic must contain the placeholders {sensor} and {window} only', error=True, sd_notify=True)
+        sys.exit(1)
+    if aggregate_interval < 1:
+        print_line('Configuration parameter aggregate_interval must be at least 1', error=True, sd_notify=True)
+        sys.exit(1)
+
+reporters = [reporter_classes[mode](base_topic) for mode in reporting_modes]
+mqtt_reporters = [reporter for reporter in reporters if reporter.mqtt]
+history_reporters = [reporter for reporter in reporters if reporter.backfill]
 
 
 print_line('Configuration accepted', console=False, sd_notify=True)
 
-# MQTT connection
-if reporting_mode in ['mqtt-json', 'mqtt-smarthome', 'homeassistant-mqtt', 'thingsboard-json', 'wirenboard-mqtt']:
-    print_line('Connecting to MQTT broker ...')
-    mqtt_client = mqtt.Client()
-    mqtt_client.on_connect = on_connect
-    mqtt_client.on_publish = on_publish
-    if reporting_mode == 'mqtt-json':
-        mqtt_client.will_set('{}/$announce'.format(base_topic), payload='{}', retain=True)
-    elif reporting_mode == 'mqtt-smarthome':
-        mqtt_client.will_set('{}/connected'.format(base_topic), payload='0', retain=True)
-
-    if config['MQTT'].getboolean('tls', False):
-        # According to the docs, setting PROTOCOL_SSLv23 "Selects the highest protocol version
-        # that both the client and server support. Despite the name, this option can select
-        # “TLS” protocols as well as “SSL”" - so this seems like a resonable default
-        mqtt_client.tls_set(
-            ca_certs=config['MQTT'].get('tls_ca_cert', None),
-            keyfile=config['MQTT'].get('tls_keyfile', None),
-            certfile=config['MQTT'].get('tls_certfile', None),
-            tls_version=ssl.PROTOCOL_SSLv23
-        )
-
-    mqtt_username = os.environ.get("MQTT_USERNAME", config['MQTT'].get('username'))
-    mqtt_password = os.environ.get("MQTT_PASSWORD", config['MQTT'].get('password', None))
-
-    if mqtt_username:
-        mqtt_client.username_pw_set(mqtt_username, mqtt_password)
+# Readings journal
+journal = None
+reading_qos = 0
+if journal_path:
+    journal = ReadingsJournal(os.path.join(state_dir, journal_path), journal_size)
+    # readings need a real acknowledgement from the broker to leave the journal
+    reading_qos = 1
+    if journal.size:
+        print_line('Readings journal "{}" holds {} bytes to replay'.format(journal.path, journal.size))
+
+# History cursors, the next history entry to retrieve per sensor MAC address
+history_cursors = dict()
+history_cursors_path = os.path.join(state_dir, history_cursors_path)
+if history_enabled and os.path.exists(history_cursors_path):
     try:
-        mqtt_client.connect(os.environ.get('MQTT_HOSTNAME', config['MQTT'].get('hostname', 'localhost')),
-                            port=int(os.environ.get('MQTT_PORT', config['MQTT'].get('port', '1883'))),
-                            keepalive=config['MQTT'].getint('keepalive', 60))
-    except:
-        print_line('MQTT connection error. Please check your settings in the configuration file "config.ini"', error=True, sd_notify=True)
+        with open(history_cursors_path) as cursors_file:
+            history_cursors = json.load(cursors_file)
+    except (IOError, ValueError) as e:
+        print_line('History cursors "{}" could not be read, retrieving complete histories: {}'.format(history_cursors_path, e), warning=True)
+
+# Device metadata cache, firmware version, device name and last known good reading per sensor MAC address
+device_cache = dict()
+if device_cache_path:
+    device_cache_path = os.path.join(state_dir, device_cache_path)
+if device_cache_path and os.path.exists(device_cache_path):
+    try:
+        with open(device_cache_path) as cache_file:
+            device_cache = json.load(cache_file, object_pairs_hook=OrderedDict)
+    except (IOError, ValueError) as e:
+        print_line('Device cache "{}" could not be read, announcing sensors without metadata: {}'.format(device_cache_path, e), warning=True)
+# written right away when the metadata of a sensor changed, the last readings only every device_cache_interval
+device_cache_changed = False
+device_cache_saved = time()
+device_cache_failed = False
+
+# Sensors announced by this daemon per reporting method, only they are retracted once no longer configured
+announced_sensors = dict()
+if announced_sensors_path:
+    announced_sensors_path = os.path.join(state_dir, announced_sensors_path)
+if announced_sensors_path and os.path.exists(announced_sensors_path):
+    try:
+        with open(announced_sensors_path) as announced_file:
+            announced_sensors = json.load(announced_file)
+    except (IOError, ValueError) as e:
+        print_line('Announced sensors "{}" could not be read, retracting no sensors: {}'.format(announced_sensors_path, e), warning=True)
+
+# Rolling aggregates of the last run per sensor MAC address
+aggregates_state = dict()
+aggregates_saved = 0
+if aggregates_path:
+    aggregates_path = os.path.join(state_dir, aggregates_path)
+if aggregate_params and aggregates_path and os.path.exists(aggregates_path):
+    try:
+        with open(aggregates_path) as aggregates_file:
+            aggregates_state = json.load(aggregates_file)
+    except (IOError, ValueError) as e:
+        print_line('Aggregates "{}" could not be read, starting them empty: {}'.format(aggregates_path, e), warning=True)
+
+# MQTT connection
+mqtt_client = None
+if mqtt_reporters:
+    mqtt_client = connect_mqtt(config['MQTT'])
+    if mqtt_client is None:
         sys.exit(1)
-    else:
-        if reporting_mode == 'mqtt-smarthome':
-            mqtt_client.publish('{}/connected'.format(base_topic), payload='1', retain=True)
-        if reporting_mode != 'thingsboard-json':
-            mqtt_client.loop_start()
-            sleep(1.0) # some slack to establish the connection
 
 sd_notifier.notify('READY=1')
 
-# Initialize Mi Flora sensors
-flores = OrderedDict()
-for [name, mac] in config['Sensors'].items():
+# Sensor entry "MAC[, period=seconds]", the period None without the option
+def parse_flora_entry(entry):
+    mac, sensor_options = parse_sensor_entry(entry)
+    period = sensor_options.pop('period', None)
+    if period is not None:
+        period = int(period)
+        if period < 1:
+            raise ValueError('The period "{}" must be at least 1 second'.format(period))
+    if sensor_options:
+        raise ValueError('Unknown sensor option "{}"'.format(next(iter(sensor_options))))
     if not re.match("[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}", mac.lower()):
-        print_line('The MAC address "{}" seems to be in the wrong format. Please check your configuration'.format(mac), error=True, sd_notify=True)
-        sys.exit(1)
+        raise ValueError('The MAC address "{}" seems to be in the wrong format'.format(mac))
+    return mac, period
 
+# Set up a Mi Flora sensor, without connecting to it
+def create_flora(name, mac, period, adapter):
     if '@' in name:
         name_pretty, location_pretty = name.split('@')
     else:
@@ -189,301 +1923,678 @@ for [name, mac] in config['Sensors'].items():
     location_clean = clean_identifier(location_pretty)
 
     flora = OrderedDict()
-    print('Adding sensor to device list and testing connection ...')
+    print('Adding sensor to device list ...')
     print('Name:          "{}"'.format(name_pretty))
-    # print_line('Attempting initial connection to Mi Flora sensor "{}" ({})'.format(name_pretty, mac), console=False, sd_notify=True)
 
-    flora_poller = MiFloraPoller(mac=mac, backend=BluepyBackend, cache_timeout=miflora_cache_timeout, adapter=used_adapter)
-    flora['poller'] = flora_poller
+    # no connection yet, the first measurement verifies the sensor and the cached metadata
+    cached = device_cache.get(mac.lower(), dict())
+    flora_reader = FloraReader(mac, ble_backends[ble_backend], adapter, name_clean)
+    flora_reader.device_name = cached.get('device_name')
+    flora['reader'] = flora_reader
+    flora['adapter'] = adapter
+    flora['name'] = name_clean
     flora['name_pretty'] = name_pretty
-    flora['mac'] = flora_poller._mac
-    flora['refresh'] = sleep_period
+    flora['mac'] = mac
+    # the config entry, compared on reload
+    flora['config_name'] = name
+    flora['period'] = period
+    flora['refresh'] = sleep_period if period is None else period
     flora['location_clean'] = location_clean
     flora['location_pretty'] = location_pretty
-    flora['stats'] = {"count": 0, "success": 0, "failure": 0}
-    flora['firmware'] = "0.0.0"
+    flora['stats'] = {"count": 0, "success": 0, "failure": 0, "absent": 0, "consecutive_failures": 0, "health": "healthy"}
+    flora['firmware'] = cached.get('firmware', "0.0.0")
+    # last known good reading
+    flora['reading'] = cached.get('reading')
+    flora['advertised'] = dict()
+    # signal strength and the adapter receiving it best, the times the sensor was last seen and last scanned for
+    flora['rssi'] = None
+    flora['rssi_adapter'] = None
+    flora['seen'] = 0
+    flora['present'] = None
+    flora['scanned'] = 0
+    flora['history_due'] = 0
+    # last published value and its time per parameter, in the order of the parameters table
+    flora['published_values'] = array('d', [float('nan')] * len(parameters))
+    flora['published_at'] = array('d', [0.0] * len(parameters))
+    flora['aggregates'] = None
+    if aggregate_params:
+        flora['aggregates'] = RollingAggregates(aggregate_params)
+        if mac.lower() in aggregates_state:
+            try:
+                flora['aggregates'].load(aggregates_state[mac.lower()])
+            except (KeyError, TypeError, ValueError):
+                print_line('Saved aggregates of sensor "{}" do not fit, starting them empty'.format(name_pretty), warning=True)
+                flora['aggregates'] = RollingAggregates(aggregate_params)
+        flora['aggregates_due'] = 0
+    print('Internal name: "{}"'.format(name_clean))
+    print('Device name:   "{}"'.format(cached.get('device_name', 'unknown')))
+    print('MAC address:   {}'.format(mac))
+    print('Adapter:       {}'.format(adapter))
+    print('Firmware:      {}'.format(cached.get('firmware', 'unknown')))
+    print()
+    return name_clean, flora
+
+# Initialize Mi Flora sensors
+flores = OrderedDict()
+for [index, [name, entry]] in enumerate(config['Sensors'].items()):
     try:
-        flora_poller.fill_cache()
-        flora_poller.parameter_value(MI_LIGHT)
-        flora['firmware'] = flora_poller.firmware_version()
-    except (IOError, BluetoothBackendException, BTLEException, RuntimeError, BrokenPipeError) as e:
-        print_line('Initial connection to Mi Flora sensor "{}" ({}) failed due to exception: {}'.format(name_pretty, mac, e), error=True, sd_notify=True)
+        mac, period = parse_flora_entry(entry)
+    except ValueError as e:
+        print_line('The sensor entry "{}" is invalid: {}. Please check your configuration'.format(name, e), error=True, sd_notify=True)
+        sys.exit(1)
+    flora_name, flora = create_flora(name, mac, period, used_adapters[index % len(used_adapters)])
+    flores[flora_name] = flora
+
+# Topics and payload skeletons of every sensor, computed once
+for reporter in reporters:
+    for [flora_name, flora] in flores.items():
+        reporter.register(flora_name, flora)
+
+# Publish the health state of a sensor, as Homie device $state or Home Assistant availability
+def publish_health(flora_name, flora):
+    for reporter in reporters:
+        reporter.publish_health(flora_name, flora)
+
+# Retained discovery messages of earlier runs, unchanged ones are not published again
+def sync_discovery():
+    global discovery_pending
+    discovery_filters = [topic_filter for reporter in mqtt_reporters for topic_filter in reporter.discovery_filters()]
+    discovery_pending = False
+    if not discovery_filters or not discovery_sync:
+        return
+    # tried again once connected, the sensors removed meanwhile are retracted then
+    discovery_pending = True
+    if not mqtt_client.connection_established.is_set():
+        return
+    retained = mqtt_client.collect_retained(discovery_filters, discovery_sync)
+    if retained is None:
+        print_line('Retained discovery messages not received, announcing all sensors', warning=True)
+        return
+    discovery_pending = False
+    print_line('Received {} retained discovery message(s)'.format(len(retained)))
+    for [mode, reporter] in zip(reporting_modes, reporters):
+        if not reporter.mqtt:
+            continue
+        reporter.retained = {topic: payload for [topic, payload] in retained.items()
+                             if any(mqtt.topic_matches_sub(topic_filter, topic) for topic_filter in reporter.discovery_filters())}
+        # the sensors of other daemons on the same broker are left alone
+        removed = [device for device in reporter.removed_sensors() if device in announced_sensors.get(mode, [])]
+        if removed:
+            print_line('Retracting {} sensor(s) no longer configured: {}'.format(len(removed), ', '.join(removed)))
+            reporter.retract(removed)
+
+# Remember the sensors announced by this daemon, the ones retracted on a later start
+# Without a completed sync the sensors not retracted yet are kept as well
+def save_announced_sensors():
+    for [mode, reporter] in zip(reporting_modes, reporters):
+        if reporter.mqtt:
+            devices = set(reporter.device_id(flora_name) for flora_name in flores)
+            if discovery_pending:
+                devices.update(announced_sensors.get(mode, []))
+            announced_sensors[mode] = sorted(devices)
+    try:
+        with open(announced_sensors_path + '.tmp', 'w') as announced_file:
+            json.dump(announced_sensors, announced_file)
+        os.replace(announced_sensors_path + '.tmp', announced_sensors_path)
+    except IOError as e:
+        print_line('Announced sensors "{}" could not be written: {}'.format(announced_sensors_path, e), error=True)
+
+# Discovery Announcement of the given sensors, at startup and after a firmware change
+def announce(flora_names):
+    for reporter in reporters:
+        reporter.announce(flora_names)
+    if mqtt_client is not None:
+        mqtt_client.wait_for_acks()
+        print()
+
+# from the cached metadata, sensors with a changed firmware are announced again after their first measurement
+discovery_pending = False
+if mqtt_client is not None:
+    sync_discovery()
+announce(list(flores))
+if mqtt_client is not None and announced_sensors_path:
+    save_announced_sensors()
+reannounce = []
+
+print_line('Initialization complete, starting MQTT publish loop', console=False, sd_notify=True)
+
+
+# Metrics endpoint
+if metrics_port:
+    try:
+        metrics_server = ThreadingHTTPServer((metrics_address, metrics_port), MetricsRequestHandler)
+    except OSError as e:
+        print_line('Metrics endpoint could not be started on {}:{}: {}'.format(metrics_address, metrics_port, e), error=True, sd_notify=True)
     else:
-        print('Internal name: "{}"'.format(name_clean))
-        print('Device name:   "{}"'.format(flora_poller.name()))
-        print('MAC address:   {}'.format(flora_poller._mac))
-        print('Firmware:      {}'.format(flora_poller.firmware_version()))
-        print_line('Initial connection to Mi Flora sensor "{}" ({}) successful'.format(name_pretty, mac), sd_notify=True)
-        if int(flora_poller.firmware_version().replace(".", "")) < 319:
-            print_line('Mi Flora sensor with a firmware version before 3.1.9 is not supported. Please update now.'.format(name_pretty, mac), error=True, sd_notify=True)
+        metrics_server.daemon_threads = True
+        Thread(target=metrics_server.serve_forever, daemon=True).start()
+        print_line('Serving metrics on http://{}:{}/metrics'.format(metrics_address, metrics_port))
 
-    print()
-    flores[name_clean] = flora
+# Start listening for sensor advertisements on every adapter
+flores_by_mac = {flora['mac'].lower(): flora for flora in flores.values()}
+if daemon_mode == 'passive':
+    for adapter in used_adapters:
+        Thread(target=AdvertisementListener(adapter).run, daemon=True).start()
+    print_line('Listening for Mi Flora advertisements on {}'.format(', '.join(used_adapters)))
 
-# Discovery Announcement
-if reporting_mode == 'mqtt-json':
-    print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
-    flores_info = dict()
-    for [flora_name, flora] in flores.items():
-        flora_info = {key: value for key, value in flora.items() if key not in ['poller', 'stats']}
-        flora_info['topic'] = '{}/{}'.format(base_topic, flora_name)
-        flores_info[flora_name] = flora_info
-    mqtt_client.publish('{}/$announce'.format(base_topic), json.dumps(flores_info), retain=True)
-    sleep(0.5) # some slack for the publish roundtrip and callback function
-    print()
-elif reporting_mode == 'mqtt-homie':
-    mqtt_client = OrderedDict()
-    print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
+# Start one polling worker per adapter and concurrency slot
+adapter_jobs = OrderedDict()
+poll_results = Queue()
+for adapter in used_adapters:
+    adapter_jobs[adapter] = Queue()
+    for _ in range(adapter_concurrency):
+        Thread(target=adapter_worker, args=(adapter_jobs[adapter], poll_results), daemon=True).start()
 
-    for [flora_name, flora] in flores.items():
-        print_line('Connecting to MQTT broker for "{}" ...'.format(flora['name_pretty']))
-        mqtt_client[flora_name.lower()] = mqtt.Client(flora_name.lower())
-        mqtt_client[flora_name.lower()].on_connect = on_connect
-        mqtt_client[flora_name.lower()].on_publish = on_publish
-        mqtt_client[flora_name.lower()].will_set('{}/{}/$state'.format(base_topic, flora_name.lower()), payload='disconnected', retain=True)
+# Deadband filter, the parameters of a reading which moved past their deadband or are due for the heartbeat
+# Reporters with one payload per reading publish all parameters as soon as one of them is due
+def deadband_filter(flora, data, timestamp):
+    due = OrderedDict()
+    for [index, param] in enumerate(parameters):
+        if param not in data:
+            continue
+        deadband = parameters[param].get('deadband')
+        last = flora['published_values'][index]
+        if deadband is None or isnan(last) or abs(data[param] - last) > deadband \
+                or (heartbeat and timestamp + flora['refresh'] / 2 >= flora['published_at'][index] + heartbeat):
+            due[param] = data[param]
+    return due
 
-        if config['MQTT'].getboolean('tls', False):
-            # According to the docs, setting PROTOCOL_SSLv23 "Selects the highest protocol version
-            # that both the client and server support. Despite the name, this option can select
-            # “TLS” protocols as well as “SSL”" - so this seems like a resonable default
-            mqtt_client[flora_name.lower()].tls_set(
-                ca_certs=config['MQTT'].get('tls_ca_cert', None),
-                keyfile=config['MQTT'].get('tls_keyfile', None),
-                certfile=config['MQTT'].get('tls_certfile', None),
-                tls_version=ssl.PROTOCOL_SSLv23
-            )
+def record_published(flora, data, timestamp):
+    for [index, param] in enumerate(parameters):
+        if param in data:
+            flora['published_values'][index] = data[param]
+            flora['published_at'][index] = timestamp
 
-        mqtt_username = os.environ.get("MQTT_USERNAME", config['MQTT'].get('username'))
-        mqtt_password = os.environ.get("MQTT_PASSWORD", config['MQTT'].get('password', None))
+# Publish a reading through every reporter, keeping it in the journal when its publication can't be confirmed
+def report_reading(flora_name, flora, data, timestamp):
+    due = deadband_filter(flora, data, timestamp)
+    if not due:
+        print_line('No value of "{}" moved past its deadband, nothing to publish'.format(flora['name_pretty']))
+        return
+    for reporter in reporters:
+        if not reporter.mqtt:
+            reporter.publish(flora_name, flora, OrderedDict(due if reporter.per_parameter else data), timestamp)
+    if mqtt_client is None:
+        record_published(flora, due, timestamp)
+        return
+    if journal is not None and (journal.size or not mqtt_client.connection_established.is_set()):
+        # keep the readings in order while a backlog waits for replay
+        print_line('Keeping reading of "{}" in the journal'.format(flora['name_pretty']))
+        journal.append(flora_name, timestamp, data)
+        record_published(flora, due, timestamp)
+        return
+    published = time()
+    for reporter in mqtt_reporters:
+        reporter.publish(flora_name, flora, OrderedDict(due if reporter.per_parameter else data), timestamp)
+    if all(reporter.batched for reporter in mqtt_reporters):
+        record_published(flora, due, timestamp)
+        return
+    lost = mqtt_client.wait_for_acks()
+    if not lost:
+        metrics.observe('miflora_publish_ack_seconds', time() - published, sensor=flora_name, adapter=flora['adapter'])
+        record_published(flora, due, timestamp)
+    elif journal is not None:
+        print_line('Publication of "{}" not confirmed, keeping reading in the journal'.format(flora['name_pretty']), warning=True)
+        journal.append(flora_name, timestamp, data)
+        record_published(flora, due, timestamp)
 
-        if mqtt_username:
-            mqtt_client[flora_name.lower()].username_pw_set(mqtt_username, mqtt_password)
-        try:
-            mqtt_client[flora_name.lower()].connect(os.environ.get('MQTT_HOSTNAME', config['MQTT'].get('hostname', 'localhost')),
-                                port=int(os.environ.get('MQTT_PORT', config['MQTT'].get('port', '1883'))),
-                                keepalive=config['MQTT'].getint('keepalive', 60))
-        except:
-            print_line('MQTT connection error. Please check your settings in the configuration file "config.ini"', error=True, sd_notify=True)
-            sys.exit(1)
+# Publish the readings collected by the batching reporters and wait for all acknowledgements
+# Unconfirmed readings go to the journal, except those of the sensor the caller journals itself
+def flush_reporters(journalled_flora=None):
+    readings = []
+    for reporter in reporters:
+        readings += reporter.flush()
+    if mqtt_client is None or mqtt_client.wait_for_acks() == 0:
+        return True
+    readings = [reading for reading in readings if reading[0] != journalled_flora]
+    if readings and journal is not None:
+        print_line('Publication of the telemetry batch not confirmed, keeping readings in the journal', warning=True)
+        for [flora_name, timestamp, data] in readings:
+            journal.append(flora_name, timestamp, data)
+    return False
+
+# Replay a batch of journalled readings with their original timestamps
+def replay_journal():
+    entries, consumed = journal.read(journal_batch_size)
+    for entry in entries:
+        if entry['sensor'] not in flores:
+            # removed from the configuration
+            continue
+        for reporter in mqtt_reporters:
+            reporter.publish(entry['sensor'], flores[entry['sensor']], OrderedDict(entry['data']), entry['ts'], replayed=True)
+    for reporter in mqtt_reporters:
+        reporter.flush()
+    if mqtt_client.wait_for_acks():
+        print_line('Replay of journalled readings not confirmed, retrying later', warning=True)
+        return
+    journal.drop(consumed)
+    print_line('Replayed {} journalled reading(s), {} bytes left in the journal'.format(len(entries), journal.size))
+
+# Publish the retrieved history entries of a sensor through the reporters publishing old readings and advance its cursor
+def report_history(flora_name, flora, history):
+    cursor, history_length, entries = history
+    previous = history_cursors.get(flora['mac'], 0)
+    flora['history_due'] = time() + history_interval
+    if entries:
+        print_line('Publishing {} history entries of sensor "{}"'.format(len(entries), flora['name_pretty']))
+        keep = journal is not None and mqtt_client is not None and (journal.size or not mqtt_client.connection_established.is_set())
+        for [timestamp, data] in entries:
+            for reporter in history_reporters:
+                if not reporter.mqtt or not keep:
+                    reporter.publish(flora_name, flora, OrderedDict(data), timestamp, replayed=True)
+            if keep:
+                journal.append(flora_name, timestamp, data)
+        if not keep and not flush_reporters(journalled_flora=flora_name):
+            if journal is None:
+                print_line('Publication of the history of "{}" not confirmed, retrying later'.format(flora['name_pretty']), warning=True)
+                return
+            for [timestamp, data] in entries:
+                journal.append(flora_name, timestamp, data)
+    history_cursors[flora['mac']] = cursor
+    try:
+        with open(history_cursors_path, 'w') as cursors_file:
+            json.dump(history_cursors, cursors_file)
+    except IOError as e:
+        print_line('History cursors "{}" could not be written: {}'.format(history_cursors_path, e), error=True)
+    if cursor < history_length and cursor != previous:
+        # more entries waiting, continue with the next poll
+        flora['history_due'] = 0
+
+# Circuit breaker per sensor, driven by its poll statistics
+# healthy -> degraded after a failed poll -> open after breaker_threshold failed polls in a row, back to healthy on success
+def update_health(flora_name, flora, success):
+    stats = flora['stats']
+    previous = stats['health']
+    if success:
+        stats['success'] += 1
+        stats['consecutive_failures'] = 0
+        stats['health'] = 'healthy'
+    else:
+        stats['failure'] += 1
+        stats['consecutive_failures'] += 1
+        if breaker_threshold and stats['consecutive_failures'] >= breaker_threshold:
+            stats['health'] = 'open'
         else:
-            mqtt_client[flora_name.lower()].loop_start()
-            sleep(1.0) # some slack to establish the connection
-
-        topic_path = '{}/{}'.format(base_topic, flora_name.lower())
-
-        mqtt_client[flora_name.lower()].publish('{}/$homie'.format(topic_path), '3.0', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$name'.format(topic_path), flora['name_pretty'], 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$state'.format(topic_path), 'ready', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$mac'.format(topic_path), flora['mac'], 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$stats'.format(topic_path), 'interval,timestamp', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$stats/interval'.format(topic_path), flora['refresh'], 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$stats/timestamp'.format(topic_path), strftime('%Y-%m-%dT%H:%M:%S%z', localtime()), 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$fw/name'.format(topic_path), 'miflora-firmware', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$fw/version'.format(topic_path), flora['firmware'], 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$nodes'.format(topic_path), 'sensor', 1, True)
+            stats['health'] = 'degraded'
+    if stats['health'] != previous:
+        print_line('Sensor "{}" changed from {} to {}'.format(flora['name_pretty'], previous, stats['health']),
+                   warning=stats['health'] != 'healthy', sd_notify=True)
+        publish_health(flora_name, flora)
 
-        sensor_path = '{}/sensor'.format(topic_path)
+# Keep the metadata of a successfully polled sensor, a changed firmware version is announced at the end of the cycle
+def update_device_cache(flora_name, flora, reading):
+    global device_cache_changed
+    firmware = reading.firmware
+    if firmware is not None and firmware != flora['firmware']:
+        if flora['mac'].lower() in device_cache:
+            print_line('Firmware of sensor "{}" changed from {} to {}'.format(flora['name_pretty'], flora['firmware'], firmware), sd_notify=True)
+        if int(firmware.replace(".", "")) < 319:
+            print_line('Mi Flora sensor "{}" has a firmware version before 3.1.9, which is not supported. Please update now.'.format(flora['name_pretty']), error=True, sd_notify=True)
+        flora['firmware'] = firmware
+        reannounce.append(flora_name)
+    flora['reading'] = reading.data()
+    cached = device_cache.get(flora['mac'].lower(), dict())
+    if cached.get('firmware') != flora['firmware'] or cached.get('device_name') != reading.device_name:
+        device_cache_changed = True
+    device_cache[flora['mac'].lower()] = OrderedDict([('firmware', flora['firmware']), ('device_name', reading.device_name),
+                                                      ('reading', flora['reading']), ('timestamp', int(reading.timestamp))])
 
-        mqtt_client[flora_name.lower()].publish('{}/$name'.format(sensor_path), 'miflora', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/$properties'.format(sensor_path), 'battery,conductivity,light,moisture,temperature', 1, True)
-
-        mqtt_client[flora_name.lower()].publish('{}/battery/$name'.format(sensor_path), 'battery', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/battery/$settable'.format(sensor_path), 'false', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/battery/$unit'.format(sensor_path), '%', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/battery/$datatype'.format(sensor_path), 'integer', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/battery/$format'.format(sensor_path), '0:100', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/battery/$retained'.format(sensor_path), 'true', 1, True)
-
-        mqtt_client[flora_name.lower()].publish('{}/conductivity/$name'.format(sensor_path), 'conductivity', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/conductivity/$settable'.format(sensor_path), 'false', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/conductivity/$unit'.format(sensor_path), 'µS/cm', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/conductivity/$datatype'.format(sensor_path), 'integer', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/conductivity/$format'.format(sensor_path), '0:*', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/conductivity/$retained'.format(sensor_path), 'true', 1, True)
-
-        mqtt_client[flora_name.lower()].publish('{}/light/$name'.format(sensor_path), 'light', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/light/$settable'.format(sensor_path), 'false', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/light/$unit'.format(sensor_path), 'lux', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/light/$datatype'.format(sensor_path), 'integer', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/light/$format'.format(sensor_path), '0:50000', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/light/$retained'.format(sensor_path), 'true', 1, True)
-
-        mqtt_client[flora_name.lower()].publish('{}/moisture/$name'.format(sensor_path), 'moisture', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/moisture/$settable'.format(sensor_path), 'false', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/moisture/$unit'.format(sensor_path), '%', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/moisture/$datatype'.format(sensor_path), 'integer', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/moisture/$format'.format(sensor_path), '0:100', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/moisture/$retained'.format(sensor_path), 'true', 1, True)
-
-        mqtt_client[flora_name.lower()].publish('{}/temperature/$name'.format(sensor_path), 'temperature', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/temperature/$settable'.format(sensor_path), 'false', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/temperature/$unit'.format(sensor_path), '°C', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/temperature/$datatype'.format(sensor_path), 'float', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/temperature/$format'.format(sensor_path), '*', 1, True)
-        mqtt_client[flora_name.lower()].publish('{}/temperature/$retained'.format(sensor_path), 'true', 1, True)
-    sleep(0.5) # some slack for the publish roundtrip and callback function
-    print()
-elif reporting_mode == 'homeassistant-mqtt':
-    print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
-    for [flora_name, flora] in flores.items():
-        state_topic = '{}/sensor/{}/state'.format(base_topic, flora_name.lower())
-        for [sensor, params] in parameters.items():
-            discovery_topic = 'homeassistant/sensor/{}/{}/config'.format(flora_name.lower(), sensor)
-            payload = OrderedDict()
-            payload['name'] = "{} {}".format(flora_name, sensor.title())
-            payload['unique_id'] = "{}-{}".format(flora['mac'].lower().replace(":", ""), sensor)
-            payload['unit_of_measurement'] = params['unit']
-            if 'device_class' in params:
-                payload['device_class'] = params['device_class']
-            if 'state_class' in params:
-                payload['state_class'] = params['state_class']
-            payload['state_topic'] = state_topic
-            payload['value_template'] = "{{{{ value_json.{} }}}}".format(sensor)
-            payload['device'] = {
-                    'identifiers' : ["MiFlora{}".format(flora['mac'].lower().replace(":", ""))],
-                    'connections' : [["mac", flora['mac'].lower()]],
-                    'manufacturer' : 'Xiaomi',
-                    'name' : flora_name,
-                    'model' : 'MiFlora Plant Sensor (HHCCJCY01)',
-                    'sw_version': flora['firmware']
-            }
-            payload['expire_after'] = str(int(sleep_period * 1.5))
-            mqtt_client.publish(discovery_topic, json.dumps(payload), 1, True)
-elif reporting_mode == 'gladys-mqtt':
-    print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
-    
-    for [flora_name, flora] in flores.items():
-        topic_path = '{}/mqtt:miflora:{}/feature'.format(base_topic, flora_name.lower())
-        data = OrderedDict()
-        for param,_ in parameters.items():
-            data[param] = flora['poller'].parameter_value(param)
-        mqtt_client.publish('{}/mqtt:battery/state'.format(topic_path),data['battery'],1,True)
-        mqtt_client.publish('{}/mqtt:moisture/state'.format(topic_path),data['moisture'],1,True)
-        mqtt_client.publish('{}/mqtt:light/state'.format(topic_path),data['light'],1,True)
-        mqtt_client.publish('{}/mqtt:conductivity/state'.format(topic_path),data['conductivity'],1,True)
-        mqtt_client.publish('{}/mqtt:temperature/state'.format(topic_path),data['temperature'],1,True)
-
-
-    sleep(0.5) # some slack for the publish roundtrip and callback function
-    print()
-elif reporting_mode == 'wirenboard-mqtt':
-    print_line('Announcing Mi Flora devices to MQTT broker for auto-discovery ...')
+def save_device_cache():
+    global device_cache_changed, device_cache_saved, device_cache_failed
+    device_cache_changed = False
+    device_cache_saved = time()
+    try:
+        with open(device_cache_path + '.tmp', 'w') as cache_file:
+            json.dump(device_cache, cache_file)
+        os.replace(device_cache_path + '.tmp', device_cache_path)
+    except IOError as e:
+        # logged once, not on every cycle
+        if not device_cache_failed:
+            print_line('Device cache "{}" could not be written: {}'.format(device_cache_path, e), error=True, sd_notify=True)
+        device_cache_failed = True
+        return
+    if device_cache_failed:
+        print_line('Device cache "{}" written again'.format(device_cache_path))
+    device_cache_failed = False
+
+# Publish the rolling aggregates of a sensor, one retained message per window
+def publish_aggregates(flora_name, flora, now):
+    for window in RollingAggregates.windows:
+        topic = aggregate_topic.format(sensor=flora_name, window=window)
+        print_line('Publishing aggregates to MQTT topic "{}"'.format(topic))
+        mqtt_client.publish(topic, json.dumps(flora['aggregates'].summary(window, now)), 1, True)
+    flora['aggregates_due'] = now + aggregate_interval
+
+def save_aggregates():
+    global aggregates_saved
+    state = OrderedDict((flora['mac'].lower(), flora['aggregates'].state()) for flora in flores.values())
+    try:
+        with open(aggregates_path + '.tmp', 'w') as aggregates_file:
+            json.dump(state, aggregates_file)
+        os.replace(aggregates_path + '.tmp', aggregates_path)
+    except IOError as e:
+        print_line('Aggregates "{}" could not be written: {}'.format(aggregates_path, e), error=True)
+    aggregates_saved = time()
+
+# Put a sensor back on the schedule, keeping its period independent of the polling duration
+# Sensors missed by the presence scan keep their period, they are checked again by the next scan
+def schedule_flora(schedule, flora_name, flora, absent=False):
+    now = time()
+    if flora['stats']['health'] == 'open' and not absent:
+        # probe with exponential backoff instead of every period
+        exponent = flora['stats']['consecutive_failures'] - breaker_threshold + 1
+        backoff = min(flora['refresh'] * 2 ** exponent, max(breaker_max_backoff, flora['refresh']))
+        flora['due'] = now + backoff
+        print_line('Circuit of sensor "{}" open, probing again in {:.0f} seconds'.format(flora['name_pretty'], backoff), warning=True)
+        heappush(schedule, (flora['due'] + uniform(0, jitter), flora_name))
+        return
+    flora['due'] += flora['refresh']
+    if flora['due'] <= now:
+        if overrun_policy == 'skip':
+            # drop the missed periods but keep the phase
+            flora['due'] += (int((now - flora['due']) // flora['refresh']) + 1) * flora['refresh']
+        elif overrun_policy == 'reset':
+            flora['due'] = now + flora['refresh']
+        # 'catch_up' keeps the due time in the past, the missed periods are polled right away
+    heappush(schedule, (flora['due'] + uniform(0, jitter), flora_name))
+
+# Re-read the configuration file and apply what changed, sensors which did not change keep their schedule and statistics
+def reload_config():
+    global config, flores_by_mac, mqtt_client, reporters, mqtt_reporters, history_reporters, discovery_sync, metrics_topic
+    print_line('Reloading configuration file "config.ini" ...', sd_notify=True)
+    new_config = ConfigParser(delimiters=('=', ), inline_comment_prefixes=('#'))
+    new_config.optionxform = str
+    try:
+        with open(os.path.join(config_dir, 'config.ini')) as config_file:
+            new_config.read_file(config_file)
+        for section in ['General', 'Daemon', 'MQTT', 'Sensors']:
+            if not new_config.has_section(section):
+                raise ValueError('No [{}] section'.format(section))
+        sensors = OrderedDict((name, parse_flora_entry(entry)) for [name, entry] in new_config['Sensors'].items())
+        if not sensors:
+            raise ValueError('No sensors found')
+        broker_settings = mqtt_broker_settings(new_config['MQTT'])
+        new_discovery_sync = new_config['MQTT'].getfloat('discovery_sync', 0.5)
+        max_inflight = new_config['MQTT'].getint('max_inflight', 20)
+        ack_timeout = new_config['MQTT'].getfloat('ack_timeout', 5.0)
+        announced = (heartbeat, [params.get('deadband') for params in parameters.values()])
+        apply_daemon_settings(new_config['Daemon'])
+    except (IOError, KeyError, ValueError, ConfigParserError) as e:
+        print_line('Configuration not reloaded, keeping the current one: {}'.format(e), error=True, sd_notify=True)
+        return
+    for section in ['General', 'Daemon', 'MQTT']:
+        for option in sorted(set(config[section]) | set(new_config[section])):
+            if option not in reloadable_options[section] and config[section].get(option) != new_config[section].get(option):
+                print_line('Changed parameter "{}" in [{}] takes effect after a restart'.format(option, section), warning=True, sd_notify=True)
+    discovery_sync = new_discovery_sync
+    metrics_topic = new_config['MQTT'].get('metrics_topic', '')
+
+    # Sensors removed, or replaced by another one under the same name
+    configured = {flora['config_name']: flora_name for [flora_name, flora] in flores.items()}
+    removed = [flora_name for [name, flora_name] in configured.items()
+               if name not in sensors or sensors[name][0].lower() != flores[flora_name]['mac'].lower()]
+    if removed:
+        print_line('Removing {} sensor(s): {}'.format(len(removed), ', '.join(removed)))
+        if mqtt_client is not None:
+            for reporter in mqtt_reporters:
+                reporter.retract(removed)
+            if aggregate_params:
+                for flora_name in removed:
+                    for window in RollingAggregates.windows:
+                        mqtt_client.publish(aggregate_topic.format(sensor=flora_name, window=window), b'', 1, True)
+    removed_by_mac = dict()
+    for flora_name in removed:
+        for reporter in reporters:
+            reporter.unregister(flora_name)
+        flora = flores.pop(flora_name)
+        # statistics and aggregates kept for a renamed sensor
+        removed_by_mac[flora['mac'].lower()] = flora
+    reannounce[:] = [flora_name for flora_name in reannounce if flora_name in flores]
+
+    # Sensors with a new period, following the [Daemon] period or their own
+    changed = []
     for [flora_name, flora] in flores.items():
-        mqtt_client.publish('/devices/{}/meta/name'.format(flora_name), flora_name, 1, True)
-        topic_path = '/devices/{}/controls'.format(flora_name)
-        mqtt_client.publish('{}/battery/meta/type'.format(topic_path), 'value', 1, True)
-        mqtt_client.publish('{}/battery/meta/units'.format(topic_path), '%', 1, True)
-        mqtt_client.publish('{}/conductivity/meta/type'.format(topic_path), 'value', 1, True)
-        mqtt_client.publish('{}/conductivity/meta/units'.format(topic_path), 'µS/cm', 1, True)
-        mqtt_client.publish('{}/light/meta/type'.format(topic_path), 'value', 1, True)
-        mqtt_client.publish('{}/light/meta/units'.format(topic_path), 'lux', 1, True)
-        mqtt_client.publish('{}/moisture/meta/type'.format(topic_path), 'rel_humidity', 1, True)
-        mqtt_client.publish('{}/temperature/meta/type'.format(topic_path), 'temperature', 1, True)
-        mqtt_client.publish('{}/timestamp/meta/type'.format(topic_path), 'text', 1, True)
-    sleep(0.5) # some slack for the publish roundtrip and callback function
-    print()
+        _, flora['period'] = sensors[flora['config_name']]
+        refresh = sleep_period if flora['period'] is None else flora['period']
+        if refresh != flora['refresh']:
+            flora['refresh'] = refresh
+            changed.append(flora_name)
 
-print_line('Initialization complete, starting MQTT publish loop', console=False, sd_notify=True)
+    # New sensors, on the adapter serving the fewest
+    added = []
+    for [name, [mac, period]] in sensors.items():
+        if name in configured and configured[name] not in removed:
+            continue
+        adapter = min(used_adapters, key=lambda adapter: sum(flora['adapter'] == adapter for flora in flores.values()))
+        flora_name, flora = create_flora(name, mac, period, adapter)
+        if mac.lower() in removed_by_mac:
+            flora['stats'] = removed_by_mac[mac.lower()]['stats']
+            flora['aggregates'] = removed_by_mac[mac.lower()]['aggregates']
+        flores[flora_name] = flora
+        added.append(flora_name)
+    schedule[:] = [entry for entry in schedule if entry[1] in flores and entry[1] not in added]
+    heapify(schedule)
+    for flora_name in added:
+        flores[flora_name]['due'] = time()
+        heappush(schedule, (flores[flora_name]['due'] + uniform(0, jitter), flora_name))
+    flores_by_mac = {flora['mac'].lower(): flora for flora in flores.values()}
+
+    reconnected = False
+    if mqtt_client is not None and broker_settings != mqtt_broker_settings(config['MQTT']):
+        client = connect_mqtt(new_config['MQTT'])
+        if client is None:
+            print_line('Keeping the current MQTT connection', warning=True, sd_notify=True)
+        else:
+            # the readings of this cycle are delivered and the devices signed off before leaving the broker
+            flush_reporters()
+            for reporter in reporters:
+                reporter.shutdown()
+            mqtt_client.wait_for_acks()
+            mqtt_client.loop_stop()
+            mqtt_client.disconnect()
+            mqtt_client = client
+            reporters = [reporter_classes[mode](base_topic) for mode in reporting_modes]
+            mqtt_reporters = [reporter for reporter in reporters if reporter.mqtt]
+            history_reporters = [reporter for reporter in reporters if reporter.backfill]
+            for reporter in reporters:
+                for [flora_name, flora] in flores.items():
+                    reporter.register(flora_name, flora)
+            sync_discovery()
+            announce(list(flores))
+            reconnected = True
+    elif mqtt_client is not None:
+        mqtt_client.max_inflight = max_inflight
+        mqtt_client.ack_timeout = ack_timeout
+
+    # the discovery payloads depend on period, deadbands and heartbeat, after a reconnection all sensors are announced already
+    affected = added + changed
+    if announced != (heartbeat, [params.get('deadband') for params in parameters.values()]):
+        affected = list(flores)
+    if affected and not reconnected:
+        for reporter in reporters:
+            for flora_name in affected:
+                reporter.register(flora_name, flores[flora_name])
+        announce(affected)
+    if mqtt_client is not None and announced_sensors_path:
+        save_announced_sensors()
+    config = new_config
+    print_line('Configuration reloaded, {} sensor(s) added, {} removed, {} with a new period'.format(len(added), len(removed), len(changed)), sd_notify=True)
 
+# Reload the configuration on SIGHUP, between two poll results of the main loop
+reload_requested = Event()
+def on_sighup(signum, frame):
+    reload_requested.set()
+    # wakes the main loop, not from the handler itself as it may interrupt the queue
+    Thread(target=poll_results.put, args=(None,), daemon=True).start()
+
+signal(SIGHUP, on_sighup)
 
 # Sensor data retrieval and publication
-while True:
-    for [flora_name, flora] in flores.items():
-        data = OrderedDict()
-        attempts = 2
-        flora['poller']._cache = None
-        flora['poller']._last_read = None
+schedule = []
+schedule_start = time()
+for [flora_name, flora] in flores.items():
+    flora['due'] = schedule_start
+    heappush(schedule, (schedule_start + uniform(0, jitter), flora_name))
+in_flight = 0
+next_replay = 0
+cycle_seconds = 0.0
+peak_threads = active_count()
+
+while schedule or in_flight:
+    if reload_requested.is_set():
+        reload_requested.clear()
+        reload_config()
+    now = time()
+    if journal is not None and journal.size and now >= next_replay:
+        if mqtt_client.connection_established.is_set():
+            replay_journal()
+        next_replay = time() + journal_interval
+    due = []
+    while schedule and schedule[0][0] <= now:
+        due.append(heappop(schedule))
+    if due and in_flight == 0:
+        cycle_start = now
+        cycle_count = 0
+        cycle_messages = mqtt_client.messages_published if mqtt_client else 0
+        if presence_scan and daemon_mode != 'passive':
+            scan_presence()
+    if presence_scan:
+        # strongest signal first
+        due.sort(key=lambda entry: 1000 if flores[entry[1]]['rssi'] is None else -flores[entry[1]]['rssi'])
+    for [planned, flora_name] in due:
+        flora = flores[flora_name]
+        flora['planned'] = planned
         flora['stats']['count'] += 1
-        print_line('Retrieving data from sensor "{}" ...'.format(flora['name_pretty']))
-        while attempts != 0 and not flora['poller']._cache:
-            try:
-                flora['poller'].fill_cache()
-                flora['poller'].parameter_value(MI_LIGHT)
-            except (IOError, BluetoothBackendException, BTLEException, RuntimeError, BrokenPipeError) as e:
-                attempts -= 1
-                if attempts > 0:
-                    if len(str(e)) > 0:
-                        print_line('Retrying due to exception: {}'.format(e), error=True)
-                    else:
-                        print_line('Retrying ...', warning=True)
-                flora['poller']._cache = None
-                flora['poller']._last_read = None
-
-        if not flora['poller']._cache:
-            flora['stats']['failure'] += 1
-            if reporting_mode == 'mqtt-homie':
-                mqtt_client[flora_name.lower()].publish('{}/{}/$state'.format(base_topic, flora_name.lower()), 'disconnected', 1, True)
-            print_line('Failed to retrieve data from Mi Flora sensor "{}" ({}), success rate: {:.0%}'.format(
-                flora['name_pretty'], flora['mac'], flora['stats']['success']/flora['stats']['count']
-                ), error = True, sd_notify = True)
-            print()
-            continue
+        if presence_scan and not flora_present(flora, time()):
+            # out of range or with a dead battery, no connection attempt
+            flora['absent'] = True
+            poll_results.put((flora_name, flora, None, time(), None))
+        else:
+            adapter_jobs[flora['adapter']].put((flora_name, flora))
+        in_flight += 1
+        cycle_count += 1
+
+    wakeup = [schedule[0][0]] if schedule else []
+    if journal is not None and journal.size:
+        wakeup.append(next_replay)
+    try:
+        result = poll_results.get(timeout=max(0.0, min(wakeup) - time()) if wakeup else None)
+    except Empty:
+        continue
+    if result is None:
+        # woken up for a reload
+        continue
+    flora_name, polled, reading, started, history = result
+    data = reading.data() if reading is not None else None
+    in_flight -= 1
+    flora = flores.get(flora_name)
+    if flora is not polled:
+        # removed or replaced by a reload while being polled, possibly with another MAC address
+        print_line('Discarding result of the removed sensor "{}" ({})'.format(flora_name, polled['mac']))
+    else:
+        absent = flora.pop('absent', False)
+        flora['stats']['lateness'] = round(max(0.0, started - flora['planned']), 3)
+        metrics.observe('miflora_schedule_lateness_seconds', flora['stats']['lateness'], sensor=flora_name, adapter=flora['adapter'])
+        metrics.inc('miflora_polls_total', sensor=flora_name, adapter=flora['adapter'], result='absent' if absent else 'failure' if data is None else 'success')
+        if flora['stats']['lateness'] > 5.0:
+            print_line('Polling of sensor "{}" started {:.1f} seconds late'.format(flora['name_pretty'], flora['stats']['lateness']), warning=True)
+        if absent:
+            # not a failed connection, the circuit breaker is left alone
+            flora['stats']['absent'] += 1
         else:
-            flora['stats']['success'] += 1
-
-        for param,_ in parameters.items():
-            data[param] = flora['poller'].parameter_value(param)
-        print_line('Result: {}'.format(json.dumps(data)))
-
-        if reporting_mode == 'mqtt-json':
-            print_line('Publishing to MQTT topic "{}/{}"'.format(base_topic, flora_name))
-            mqtt_client.publish('{}/{}'.format(base_topic, flora_name), json.dumps(data))
-            sleep(0.5) # some slack for the publish roundtrip and callback function
-        elif reporting_mode == 'thingsboard-json':
-            print_line('Publishing to MQTT topic "{}" username "{}"'.format(base_topic, flora_name))
-            mqtt_client.username_pw_set(flora_name)
-            mqtt_client.reconnect()
-            sleep(1.0)
-            mqtt_client.publish('{}'.format(base_topic), json.dumps(data))
-            sleep(0.5) # some slack for the publish roundtrip and callback function
-        elif reporting_mode == 'homeassistant-mqtt':
-            print_line('Publishing to MQTT topic "{}/sensor/{}/state"'.format(base_topic, flora_name.lower()))
-            mqtt_client.publish('{}/sensor/{}/state'.format(base_topic, flora_name.lower()), json.dumps(data), retain=True)
-            sleep(0.5) # some slack for the publish roundtrip and callback function
-        elif reporting_mode == 'gladys-mqtt':
-            print_line('Publishing to MQTT topic "{}/mqtt:miflora:{}/feature"'.format(base_topic, flora_name.lower()))
-            mqtt_client.publish('{}/mqtt:miflora:{}/feature'.format(base_topic, flora_name.lower()), json.dumps(data))
-            sleep(0.5) # some slack for the publish roundtrip and callback function
-        elif reporting_mode == 'mqtt-homie':
-            print_line('Publishing data to MQTT base topic "{}/{}"'.format(base_topic, flora_name.lower()))
-            mqtt_client[flora_name.lower()].publish('{}/{}/$state'.format(base_topic, flora_name.lower()), 'ready', 1, True)
-            for [param, value] in data.items():
-                mqtt_client[flora_name.lower()].publish('{}/{}/sensor/{}'.format(base_topic, flora_name.lower(), param), value, 1, True)
-            mqtt_client[flora_name.lower()].publish('{}/{}/$stats/timestamp'.format(base_topic, flora_name.lower()), strftime('%Y-%m-%dT%H:%M:%S%z', localtime()), 1, True)
-            sleep(0.5) # some slack for the publish roundtrip and callback function
-        elif reporting_mode == 'mqtt-smarthome':
-            for [param, value] in data.items():
-                print_line('Publishing data to MQTT topic "{}/status/{}/{}"'.format(base_topic, flora_name, param))
-                payload = dict()
-                payload['val'] = value
-                payload['ts'] = int(round(time() * 1000))
-                mqtt_client.publish('{}/status/{}/{}'.format(base_topic, flora_name, param), json.dumps(payload), retain=True)
-            sleep(0.5)  # some slack for the publish roundtrip and callback function
-        elif reporting_mode == 'wirenboard-mqtt':
-            for [param, value] in data.items():
-                print_line('Publishing data to MQTT topic "/devices/{}/controls/{}"'.format(flora_name, param))
-                mqtt_client.publish('/devices/{}/controls/{}'.format(flora_name, param), value, retain=True)
-            mqtt_client.publish('/devices/{}/controls/{}'.format(flora_name, 'timestamp'), strftime('%Y-%m-%d %H:%M:%S', localtime()), retain=True)
-            sleep(0.5)  # some slack for the publish roundtrip and callback function
-        elif reporting_mode == 'json':
-            data['timestamp'] = strftime('%Y-%m-%d %H:%M:%S', localtime())
-            data['name'] = flora_name
-            data['name_pretty'] = flora['name_pretty']
-            data['mac'] = flora['mac']
-            data['firmware'] = flora['firmware']
-            print('Data for "{}": {}'.format(flora_name, json.dumps(data)))
+            update_health(flora_name, flora, data is not None)
+        if daemon_enabled:
+            schedule_flora(schedule, flora_name, flora, absent)
+
+        if data is None:
+            # publish the next reading completely
+            flora['published_values'] = array('d', [float('nan')] * len(parameters))
+            if absent:
+                print_line('Mi Flora sensor "{}" ({}) not seen by the presence scan, not connecting'.format(flora['name_pretty'], flora['mac']), warning=True)
+            else:
+                print_line('Failed to retrieve data from Mi Flora sensor "{}" ({}), success rate: {:.0%}'.format(
+                    flora['name_pretty'], flora['mac'], flora['stats']['success']/flora['stats']['count']
+                    ), error = True, sd_notify = True)
         else:
-            raise NameError('Unexpected reporting_mode.')
+            print_line('Result for "{}": {}'.format(flora['name_pretty'], json.dumps(data)))
+            if presence_scan and flora['rssi'] is not None:
+                if flora['rssi_adapter'] != flora['adapter']:
+                    print_line('Sensor "{}" is received best by {} ({} dBm), polled via {}'.format(
+                        flora['name_pretty'], flora['rssi_adapter'], flora['rssi'], flora['adapter']))
+                for reporter in mqtt_reporters:
+                    reporter.publish_rssi(flora_name, flora)
+            update_device_cache(flora_name, flora, reading)
+            if history is not None:
+                # older entries first, the live reading is the most recent state
+                report_history(flora_name, flora, history)
+            timestamp = reading.timestamp
+            report_reading(flora_name, flora, data, timestamp)
+            if flora['aggregates'] is not None:
+                # a sensor missing for more than one period is not integrated over
+                flora['aggregates'].add(timestamp, data, 2 * flora['refresh'])
+                if timestamp >= flora['aggregates_due']:
+                    publish_aggregates(flora_name, flora, timestamp)
         print()
 
-    print_line('Status messages published', console=False, sd_notify=True)
+    if in_flight == 0:
+        flush_reporters()
+        if reannounce:
+            announce(reannounce)
+            reannounce.clear()
+        if discovery_pending and mqtt_client.connection_established.is_set():
+            # the broker was not reachable at the sync
+            sync_discovery()
+            if not discovery_pending and announced_sensors_path:
+                save_announced_sensors()
+        if device_cache_path and (device_cache_changed or time() >= device_cache_saved + device_cache_interval):
+            save_device_cache()
+        if aggregate_params and aggregates_path and time() >= aggregates_saved + aggregate_interval:
+            save_aggregates()
+        print_line('Status messages published', console=False, sd_notify=True)
+        if mqtt_client is not None:
+            latencies, failures = mqtt_client.ack_statistics()
+            if latencies:
+                print_line('{} message(s) acknowledged by the MQTT broker, latency avg {:.0f} ms, max {:.0f} ms'.format(
+                    len(latencies), 1000 * sum(latencies) / len(latencies), 1000 * max(latencies)))
+            if failures:
+                print_line('{} message(s) not acknowledged by the MQTT broker'.format(failures), warning=True)
+        cycle_seconds = time() - cycle_start
+        cycle_messages = (mqtt_client.messages_published if mqtt_client else 0) - cycle_messages
+        peak_threads = max(peak_threads, active_count())
+        print_line('Polled {} sensor(s) via {} adapter(s) in {:.1f} seconds'.format(cycle_count, len(used_adapters), cycle_seconds))
+        metrics.observe('miflora_cycle_seconds', cycle_seconds)
+        if metrics_topic and mqtt_client is not None:
+            mqtt_client.publish(metrics_topic, json.dumps(metrics.snapshot()), 1, True)
+        if schedule:
+            print_line('Sleeping until the next sensor is due ({:.0f} seconds) ...'.format(max(0.0, schedule[0][0] - time())))
+            print()
 
-    if daemon_enabled:
-        print_line('Sleeping ({} seconds) ...'.format(sleep_period))
-        sleep(sleep_period)
-        print()
-    else:
-        print_line('Execution finished in non-daemon-mode', sd_notify=True)
-        if reporting_mode == 'mqtt-json':
-            mqtt_client.disconnect()
-        break
+print_line('Execution finished in non-daemon-mode', sd_notify=True)
+if device_cache_path:
+    save_device_cache()
+if aggregate_params and aggregates_path:
+    save_aggregates()
+for reporter in reporters:
+    reporter.shutdown()
+if mqtt_client is not None:
+    mqtt_client.wait_for_acks()
+    mqtt_client.disconnect()
+
+if parse_args.stats_file:
+    stats = OrderedDict()
+    stats['reporting_method'] = ', '.join(reporting_modes)
+    stats['sensors'] = len(flores)
+    stats['adapters'] = len(used_adapters)
+    stats['startup_seconds'] = round(schedule_start - daemon_start, 3)
+    stats['cycle_seconds'] = round(cycle_seconds, 3)
+    stats['cycle_messages'] = cycle_messages
+    stats['publishes_per_second'] = round(cycle_messages / cycle_seconds, 1) if cycle_seconds else 0.0
+    stats['messages_published'] = mqtt_client.messages_published if mqtt_client else 0
+    stats['polls_succeeded'] = sum(flora['stats']['success'] for flora in flores.values())
+    stats['polls_failed'] = sum(flora['stats']['failure'] for flora in flores.values())
+    stats['polls_absent'] = sum(flora['stats']['absent'] for flora in flores.values())
+    # kilobytes on Linux
+    stats['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stats['peak_threads'] = peak_threads
+    with open(parse_args.stats_file, 'w') as stats_file:
+        json.dump(stats, stats_file, indent=2)